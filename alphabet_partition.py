@@ -0,0 +1,104 @@
+# Symbolic alphabets for automata learning
+#
+# Kevin Angstadt
+# University of Michigan
+
+import logging
+
+import lstar
+
+logger = logging.getLogger(__name__)
+
+class AlphabetPartition(object):
+    '''A partition of a concrete alphabet into classes of symbols that are
+    assumed to behave the same.  The learner only sees one representative
+    per class, and a class is split when a counterexample shows that one of
+    its symbols behaves differently from the representative.'''
+    def __init__(self, alphabet, classes=None):
+        self.alphabet = list(alphabet)
+        if classes is None:
+            classes = [self.alphabet]
+        self.classes = [sorted(c) for c in classes if len(c) > 0]
+
+        self.__rep = dict()
+        for c in self.classes:
+            for a in c:
+                self.__rep[a] = c[0]
+
+    def __str__(self):
+        return " ".join(lstar.LStar.list_to_charset(c) for c in self.classes)
+
+    def representatives(self):
+        return [c[0] for c in self.classes]
+
+    def representative(self, a):
+        return self.__rep[a]
+
+    def members(self, rep):
+        for c in self.classes:
+            if c[0] == rep:
+                return c
+        raise KeyError(rep)
+
+    def abstract(self, s):
+        '''Replace every symbol of s by its representative'''
+        return "".join(self.__rep[a] for a in s)
+
+    def split(self, rep, symbols):
+        '''Move symbols out of the class of rep into a new class and return
+        the representative of the new class'''
+        symbols = set(symbols)
+        c = self.members(rep)
+        c[:] = [a for a in c if a not in symbols]
+        new_class = sorted(symbols)
+        self.classes.append(new_class)
+        for a in new_class:
+            self.__rep[a] = new_class[0]
+        return new_class[0]
+
+    def refine(self, counterexample, mat):
+        '''Check whether the counterexample still refutes the hypothesis once
+        every symbol is replaced by its representative.  If it does not, some
+        symbol behaves differently from its representative: find it, split
+        its class using membership queries, and return the new
+        representative.  Otherwise return None and the abstract
+        counterexample can be processed as usual.'''
+        abstract = self.abstract(counterexample)
+        if abstract == counterexample:
+            return None
+
+        truth = mat.isMember(counterexample)
+        if mat.isMember(abstract) == truth:
+            return None
+
+        # beta(i) replaces the first i symbols by their representatives;
+        # beta(0) != beta(n), so binary search for the symbol at which the
+        # answer changes
+        def beta(i):
+            return mat.isMember(abstract[:i] + counterexample[i:])
+
+        lo = 0
+        hi = len(counterexample)
+        while hi - lo > 1:
+            mid = (lo + hi) // 2
+            if beta(mid) == truth:
+                lo = mid
+            else:
+                hi = mid
+
+        # abstract[:lo] + a + counterexample[hi:] separates the class of the
+        # symbol at lo; ask about every other member in the same context
+        prefix = abstract[:lo]
+        suffix = counterexample[hi:]
+        rep = abstract[lo]
+        members = [a for a in self.members(rep) if a != rep]
+        answers = mat.isMemberBatch([prefix + a + suffix for a in members])
+        rep_answer = mat.isMember(prefix + rep + suffix)
+        different = [a for a, t in zip(members, answers) if t != rep_answer]
+
+        new_rep = self.split(rep, different)
+        logger.info("Split %s from %s; %d symbol classes",
+                    lstar.LStar.list_to_charset(self.members(new_rep)),
+                    lstar.LStar.list_to_charset(self.members(rep)),
+                    len(self.classes))
+        return new_rep
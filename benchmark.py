@@ -0,0 +1,127 @@
+#!/usr/bin/env python2
+# Runs cpabmcseq-test-driver.py over the test kernels with several
+# configurations and tabulates the final stats of each run.
+#
+# Example:
+#   ./benchmark.py --time-limit 5m bench-output \
+#     --variant lstar="--learner lstar" --variant kv="--learner kv"
+#
+# Compare the solver time of the regex and table harness encodings:
+#   ./benchmark.py --time-limit 5m --preset encodings bench-output
+#
+# Compare the solver time with and without regex normalization:
+#   ./benchmark.py --time-limit 5m --preset normalization bench-output
+
+from __future__ import print_function
+
+import argparse, errno, os, re, shlex, subprocess, sys, time
+
+# (name, kernel directory, kernel file, kernel function)
+KERNELS = [
+    ("astarb", "astarb", "kernel.c", "kernel"),
+    ("intersect", "intersect", "kernel.c", "kernel"),
+    ("cba", "cba", "cba.c", "kernel"),
+    ("ab-test", "ab-test", "kernel.c", "kernel"),
+]
+
+# preset name -> (variants, columns)
+PRESETS = {
+    "learners": ([
+        ("lstar", "--learner lstar"),
+        ("kv", "--learner kv"),
+    ], "member_queries,equivalence_queries,runtime"),
+    # every equivalence query goes to CPAChecker, so that its time is
+    # comparable between the encodings, and long regexes are not swapped
+    # for tables
+    "encodings": ([
+        ("regex", "--harness-encoding regex --equivalence-oracles= --max-regex-length -1"),
+        ("table", "--harness-encoding table --equivalence-oracles="),
+    ], "equivalence_queries,cpachecker_checks,cpachecker_time,runtime"),
+    # the same, for regexes as built and after brzozowski.Normalizer
+    "normalization": ([
+        ("plain", "--harness-encoding regex --equivalence-oracles= --max-regex-length -1 --no-normalize-regex"),
+        ("normalized", "--harness-encoding regex --equivalence-oracles= --max-regex-length -1"),
+    ], "equivalence_queries,cpachecker_checks,cpachecker_time,regex_chars,runtime"),
+}
+
+here = os.path.dirname(os.path.realpath(os.path.expanduser(__file__)))
+
+def read_stats(logfile):
+    '''Collect the "Final Stats" and runtime reported at the end of a run'''
+    stats = dict()
+    in_stats = False
+    with open(logfile, "r") as f:
+        for line in f:
+            if "Final Stats" in line:
+                in_stats = True
+                continue
+            m = re.search(r"Total runtime: (\d+) seconds", line)
+            if m:
+                stats["runtime"] = int(m.group(1))
+                in_stats = False
+                continue
+            if in_stats:
+                m = re.search(r": (\w+) = ([-\d.]+)$", line.rstrip())
+                if m:
+                    stats[m.group(1)] = m.group(2)
+    return stats
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("outputlocation")
+    parser.add_argument("--time-limit", default="5m")
+    parser.add_argument("--max-inp-length", default=5, type=int)
+    parser.add_argument("--kernel", action="append", default=None,
+                        help="only run the named kernel (may be repeated)")
+    parser.add_argument("--preset", default="learners", choices=sorted(PRESETS),
+                        help="variants and columns to use when none are given")
+    parser.add_argument("--variant", action="append", default=None,
+                        help="NAME=DRIVER_ARGS (may be repeated)")
+    parser.add_argument("--columns", default=None,
+                        help="comma-separated stats to report")
+
+    args = parser.parse_args()
+
+    preset_variants, preset_columns = PRESETS[args.preset]
+    if args.variant is None:
+        variants = preset_variants
+    else:
+        variants = [tuple(v.split("=", 1)) if "=" in v else (v, "") for v in args.variant]
+
+    kernels = [k for k in KERNELS if args.kernel is None or k[0] in args.kernel]
+    columns = (args.columns or preset_columns).split(",")
+
+    results = list()
+    for name, kdir, kfile, kfunc in kernels:
+        for vname, vargs in variants:
+            out = os.path.abspath(os.path.join(args.outputlocation, name, vname))
+            try:
+                os.makedirs(out)
+            except OSError as exception:
+                if exception.errno != errno.EEXIST:
+                    raise
+
+            cmd = [sys.executable,
+                   os.path.join(here, "cpabmcseq-test-driver.py"),
+                   "--time-limit", args.time_limit,
+                   "--kernel-file", kfile,
+                   "--kernel-function", kfunc,
+                   "--return-int",
+                   "--max-inp-length", str(args.max_inp_length)] + \
+                  shlex.split(vargs) + \
+                  [os.path.join(here, "test_kernels", kdir), out]
+
+            print("running {} / {}".format(name, vname), file=sys.stderr)
+            start = time.time()
+            with open(os.path.join(out, "benchmark.log"), "w") as log:
+                subprocess.call(cmd, stdout=log, stderr=subprocess.STDOUT)
+            wall = time.time() - start
+
+            stats = read_stats(os.path.join(out, "output.log"))
+            stats["wall"] = "{:.1f}".format(wall)
+            results.append((name, vname, stats))
+
+    header = ["kernel", "variant"] + columns + ["wall"]
+    print("\t".join(header))
+    for name, vname, stats in results:
+        print("\t".join([name, vname] + [str(stats.get(c, "-")) for c in columns + ["wall"]]))
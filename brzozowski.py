@@ -1,133 +1,522 @@
 """ Implements the Brzozowski method of converting state machine into RegEx """
 
-import inspect, logging, os, sys
-import copy
+import collections, cStringIO, inspect, logging, os, sys, weakref
 
 sys.path.insert(0,os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe()))) + "/dot2anml")
 sys.path.insert(0,os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe()))) + "/MNRL/python")
 
 from anml import *
 from mnrl import *
+import hypothesis_dfa, lstar
 
 logger = logging.getLogger(__name__)
 
+class EliminationOrder(object):
+    # states in reverse order of the network (the original behavior)
+    REVERSE = "reverse"
+    # fewest in-degree x out-degree first, updated as states are removed
+    DEGREE = "degree"
+    # smallest growth in regex size first (Delgado and Morais)
+    WEIGHT = "weight"
+    # strongly connected components farthest from the start first
+    SCC = "scc"
+    
+    ALL = [REVERSE, DEGREE, WEIGHT, SCC]
+    
+    # try every order and keep the shortest regex
+    AUTO = "auto"
+
 class Regex(object):
-    pass
+    '''Regexes are immutable and hash-consed: building a regex that is
+    structurally equal to a live one returns that object, so equality is
+    identity, shared subterms are stored once, and simplify() is computed
+    once per node.'''
+    __slots__ = ("__weakref__", "_simplified", "_length")
+    # (class, children...) -> live regex
+    _nodes = weakref.WeakValueDictionary()
 
-class EmptyRegex(Regex):
-    def __str__(self):
-        return "NULL"
-    def __eq__(self, other):
-        return isinstance(other,EmptyRegex)
-    def simplify(self):
+    def __new__(cls, *children):
+        key = (cls,) + children
+        node = Regex._nodes.get(key)
+        if node is None:
+            node = object.__new__(cls)
+            object.__setattr__(node, "_simplified", None)
+            object.__setattr__(node, "_length", None)
+            node._build(*children)
+            Regex._nodes[key] = node
+        return node
+    def _build(self):
+        pass
+    def _args(self):
+        '''The arguments that build this regex'''
+        return ()
+    def __reduce__(self):
+        # unpickling goes through __new__, which interns the regex again
+        return (type(self), self._args())
+    def __setattr__(self, name, value):
+        raise AttributeError("regexes are immutable")
+    def __copy__(self):
         return self
+    def __deepcopy__(self, memo):
+        return self
+    def simplify(self):
+        '''Simplify without recursion: _simplify yields each regex it needs
+        simplified, is sent the result, and finally yields _Done'''
+        if self._simplified is not None:
+            return self._simplified
+        stack = [(self, self._simplify())]
+        value = None
+        while stack:
+            node, steps = stack[-1]
+            item = steps.send(value)
+            value = None
+            if isinstance(item, _Done):
+                object.__setattr__(node, "_simplified", item.value)
+                stack.pop()
+                value = item.value
+            elif item._simplified is not None:
+                value = item._simplified
+            else:
+                stack.append((item, item._simplify()))
+        return self._simplified
+    def _simplify(self):
+        yield _Done(self)
+    def __str__(self):
+        return regexString(self, minimal=False)
+    def length(self):
+        '''len(str(self)), without building the string'''
+        if self._length is None:
+            regexLength(self, minimal=False)
+        return self._length
+
+class _Done(object):
+    '''The result of a Regex._simplify'''
+    __slots__ = ("value",)
+    def __init__(self, value):
+        self.value = value
+
+class EmptyRegex(Regex):
+    __slots__ = ()
+    def _parts(self, minimal):
+        return ["NULL"]
 
 class EpsilonRegex(Regex):
-    def __str__(self):
-        return "eps"
-    def __eq__(self, other):
-        return isinstance(other,EpsilonRegex)
-    def simplify(self):
-        return self
+    __slots__ = ()
+    def _parts(self, minimal):
+        return ["eps"]
 
 class CarRegex(Regex):
-    def __init__(self, val):
-        self.val = val
-    def __str__(self):
-        return str(self.val)
-    def __eq__(self, other):
-        if isinstance(other, CarRegex):
-            return self.val == other.val
-        else:
-            return False
-    def simplify(self):
-        return self
+    __slots__ = ("val",)
+    def _build(self, val):
+        object.__setattr__(self, "val", val)
+    def _args(self):
+        return (self.val,)
+    def _parts(self, minimal):
+        return [str(self.val)]
+    def isAtom(self):
+        '''True if the value needs no parentheses before a star'''
+        val = str(self.val)
+        if len(val) == 1 or (len(val) == 4 and val.startswith("\\x")):
+            return True
+        return val.startswith("[") and val.endswith("]") and "]" not in val[1:-1]
 
 class UnionRegex(Regex):
-    def __init__(self, re1, re2):
-        self.re1 = re1
-        self.re2 = re2
-    def __str__(self):
-        return "({})|({})".format(str(self.re1),str(self.re2))
-    def __eq__(self, other):
-        if isinstance(other, UnionRegex):
-            return self.re1 == other.re1 and self.re2 == other.re2
-        else:
-            return False
-    def simplify(self):
-        if self.re1 == self.re2:
-            r = self.re1.simplify()
+    __slots__ = ("re1", "re2")
+    def _build(self, re1, re2):
+        object.__setattr__(self, "re1", re1)
+        object.__setattr__(self, "re2", re2)
+    def _args(self):
+        return (self.re1, self.re2)
+    def _parts(self, minimal):
+        if not minimal:
+            return ["(", self.re1, ")|(", self.re2, ")"]
+        return _wrap(self.re1, _isWord(self.re1)) + ["|"] + _wrap(self.re2, _isWord(self.re2))
+    def _simplify(self):
+        if self.re1 is self.re2:
+            r = yield self.re1
         elif isinstance(self.re1, UnionRegex):
-            r = UnionRegex(self.re1.re1, UnionRegex(self.re1.re2, self.re2)).simplify()
+            r = yield UnionRegex(self.re1.re1, UnionRegex(self.re1.re2, self.re2))
         elif isinstance(self.re1, EmptyRegex):
-            r = self.re2.simplify()
+            r = yield self.re2
         elif isinstance(self.re2, EmptyRegex):
-            r = self.re1.simplify()
+            r = yield self.re1
         else:
-            re1 = self.re1.simplify()
-            re2 = self.re2.simplify()
+            re1 = yield self.re1
+            re2 = yield self.re2
             r = UnionRegex(re1, re2)
             
-            if isinstance(re1, EmptyRegex) or isinstance(re2, EmptyRegex):
-                r = r.simplify()
+            if r is not self and (isinstance(re1, EmptyRegex) or isinstance(re2, EmptyRegex)):
+                r = yield r
         # logger.debug("replacing %s with %s", str(self), str(r))
-        return r
+        yield _Done(r)
 
 class ConcatRegex(Regex):
-    def __init__(self, re1, re2):
-        self.re1 = re1
-        self.re2 = re2
-    def __str__(self):
-        return "({})({})".format(str(self.re1),str(self.re2))
-    def __eq__(self, other):
-        if isinstance(other, ConcatRegex):
-            return self.re1 == other.re1 and self.re2 == other.re2
-        else:
-            return False
-    def simplify(self):
+    __slots__ = ("re1", "re2")
+    def _build(self, re1, re2):
+        object.__setattr__(self, "re1", re1)
+        object.__setattr__(self, "re2", re2)
+    def _args(self):
+        return (self.re1, self.re2)
+    def _parts(self, minimal):
+        if not minimal:
+            return ["(", self.re1, ")(", self.re2, ")"]
+        return _wrap(self.re1, _isWord(self.re1) or isinstance(self.re1, UnionRegex)) + \
+               _wrap(self.re2, _isWord(self.re2) or isinstance(self.re2, UnionRegex))
+    def _simplify(self):
         if isinstance(self.re1, ConcatRegex):
-            r = (ConcatRegex(self.re1.re1, ConcatRegex(self.re1.re2, self.re2))).simplify()
+            r = yield ConcatRegex(self.re1.re1, ConcatRegex(self.re1.re2, self.re2))
         elif isinstance(self.re1, EpsilonRegex):
-            r = self.re2.simplify()
+            r = yield self.re2
         elif isinstance(self.re2, EpsilonRegex):
-            r = self.re1.simplify()
+            r = yield self.re1
         elif isinstance(self.re1, EmptyRegex) or isinstance(self.re2, EmptyRegex):
             r = EmptyRegex()
         else:
-            re1 = self.re1.simplify()
-            re2 = self.re2.simplify()
+            re1 = yield self.re1
+            re2 = yield self.re2
             r = ConcatRegex(re1, re2)
             
-            if isinstance(re1, EmptyRegex) or isinstance(re1, EpsilonRegex) or isinstance(re2, EmptyRegex) or isinstance(re2, EpsilonRegex):
-                r = r.simplify()
+            if r is not self and (isinstance(re1, EmptyRegex) or isinstance(re1, EpsilonRegex) or isinstance(re2, EmptyRegex) or isinstance(re2, EpsilonRegex)):
+                r = yield r
         # logger.debug("replacing %s with %s", str(self), str(r))
-        return r
+        yield _Done(r)
 
     
 class StarRegex(Regex):
-    def __init__(self, re):
-        self.re = re
-    def __str__(self):
-        return "({})*".format(str(self.re))
-    def __eq__(self, other):
-        if isinstance(other, StarRegex):
-            return self.re == other.re
-        else:
-            return False
-    def simplify(self):
+    __slots__ = ("re",)
+    def _build(self, re):
+        object.__setattr__(self, "re", re)
+    def _args(self):
+        return (self.re,)
+    def _parts(self, minimal):
+        if not minimal:
+            return ["(", self.re, ")*"]
+        return _wrap(self.re, not (isinstance(self.re, CarRegex) and self.re.isAtom())) + ["*"]
+    def _simplify(self):
         if isinstance(self.re, EmptyRegex):
             r = EpsilonRegex()
         elif isinstance(self.re, EpsilonRegex):
             r = EpsilonRegex()
         else:
-            re = self.re.simplify()
+            re = yield self.re
             r = StarRegex(re)
-            if isinstance(re, EmptyRegex) or isinstance(re, EpsilonRegex):
-                r = r.simplify()
+            if r is not self and (isinstance(re, EmptyRegex) or isinstance(re, EpsilonRegex)):
+                r = yield r
         # logger.debug("replacing %s with %s", str(self), str(r))
-        return r
+        yield _Done(r)
+        
+def _isWord(re):
+    # eps and NULL stay in parentheses so that they never run into the
+    # text around them
+    return isinstance(re, EmptyRegex) or isinstance(re, EpsilonRegex)
+
+def _wrap(re, parenthesize):
+    return ["(", re, ")"] if parenthesize else [re]
+
+def writeRegex(re, out, minimal=True):
+    '''Write re to the file-like out without recursion.  With minimal,
+    parentheses are only written where precedence (star, then
+    concatenation, then union) needs them; otherwise every subterm is
+    parenthesized, as str() does.'''
+    stack = [re]
+    chunk = list()
+    while stack:
+        item = stack.pop()
+        if isinstance(item, Regex):
+            stack.extend(reversed(item._parts(minimal)))
+        else:
+            chunk.append(item)
+            if len(chunk) >= 4096:
+                out.write("".join(chunk))
+                chunk = list()
+    out.write("".join(chunk))
+
+def regexString(re, minimal=True):
+    out = cStringIO.StringIO()
+    writeRegex(re, out, minimal)
+    return out.getvalue()
+
+def regexLength(re, minimal=True, lengths=None):
+    '''The length of what writeRegex writes for re, computed once per
+    distinct subterm and without recursion.  lengths may be a dict kept
+    across calls with the same minimal.'''
+    if lengths is None:
+        lengths = dict()
+    stack = [re]
+    while stack:
+        node = stack[-1]
+        if node in lengths:
+            stack.pop()
+            continue
+        if not minimal and node._length is not None:
+            lengths[node] = node._length
+            stack.pop()
+            continue
+        parts = node._parts(minimal)
+        missing = [part for part in parts if isinstance(part, Regex) and part not in lengths]
+        if missing:
+            stack.extend(missing)
+            continue
+        stack.pop()
+        lengths[node] = sum(lengths[part] if isinstance(part, Regex) else len(part) for part in parts)
+        if not minimal:
+            object.__setattr__(node, "_length", lengths[node])
+    return lengths[re]
+
+def _operands(re):
+    '''The branches of a union, the factors of a concatenation or the
+    body of a star'''
+    if isinstance(re, UnionRegex):
+        return _branches(re)
+    if isinstance(re, ConcatRegex):
+        return _factors(re)
+    return [part for part in re._parts(False) if isinstance(part, Regex)]
+
+def _branches(re):
+    '''The alternatives of a union, left to right'''
+    branches = list()
+    stack = [re]
+    while stack:
+        node = stack.pop()
+        if isinstance(node, UnionRegex):
+            stack.extend([node.re2, node.re1])
+        else:
+            branches.append(node)
+    return branches
+
+def _factors(re):
+    '''The factors of a concatenation, left to right'''
+    factors = list()
+    stack = [re]
+    while stack:
+        node = stack.pop()
+        if isinstance(node, ConcatRegex):
+            stack.extend([node.re2, node.re1])
+        else:
+            factors.append(node)
+    return factors
+
+def _union(branches):
+    if not branches:
+        return EmptyRegex()
+    re = branches[-1]
+    for branch in reversed(branches[:-1]):
+        re = UnionRegex(branch, re)
+    return re
+
+def _concat(factors):
+    if not factors:
+        return EpsilonRegex()
+    re = factors[-1]
+    for factor in reversed(factors[:-1]):
+        re = ConcatRegex(factor, re)
+    return re
+
+class Normalizer(object):
+    '''Rewrites a simplified regex into a shorter equivalent one:
+    
+    * character atoms in a union are merged into one charset,
+    * common prefixes or suffixes of union branches are factored out
+      when that makes the regex shorter,
+    * (r*)* = r*, (eps|r)* = r*, (r*|s)* = (r|s)*, r*r* = r*,
+      eps|r* = r* and eps|rr* = eps|r*r = r*.
+    
+    Each chain of unions or concatenations is normalized once as a whole,
+    bottom up with an explicit stack.  Factoring a union needs the unions
+    of what follows (or precedes) each shared factor; these are also
+    built on an explicit stack, and each distinct union only once.'''
+    def __init__(self):
+        self.normalized = dict()
+        self.charsets = dict()
+        self.lengths = dict()
+        # branches -> normalized union, since factoring both ends of a union
+        # reaches the same unions of rests many times
+        self.unions = dict()
+    
+    def normalize(self, re):
+        stack = [re]
+        while stack:
+            node = stack[-1]
+            if node in self.normalized:
+                stack.pop()
+                continue
+            missing = [child for child in _operands(node) if child not in self.normalized]
+            if missing:
+                stack.extend(missing)
+                continue
+            stack.pop()
+            self.normalized[node] = self.__rewrite(node)
+        return self.normalized[re]
+    
+    def __rewrite(self, node):
+        # a whole chain of unions or concatenations is rewritten at once
+        if isinstance(node, UnionRegex):
+            branches = list()
+            for b in _branches(node):
+                branches.extend(_branches(self.normalized[b]))
+            return self.__union(branches)
+        if isinstance(node, ConcatRegex):
+            factors = list()
+            for f in _factors(node):
+                factors.extend(_factors(self.normalized[f]))
+            return self.__concat(factors)
+        if isinstance(node, StarRegex):
+            return self.__star(self.normalized[node.re])
+        return node
+    
+    def __star(self, re):
+        if isinstance(re, StarRegex):
+            return re
+        if isinstance(re, EmptyRegex) or isinstance(re, EpsilonRegex):
+            return EpsilonRegex()
+        if isinstance(re, UnionRegex):
+            branches = [b.re if isinstance(b, StarRegex) else b
+                        for b in _branches(re) if not isinstance(b, EpsilonRegex)]
+            re = self.__union(branches)
+            if not isinstance(re, UnionRegex):
+                return self.__star(re)
+        return StarRegex(re)
+    
+    def __concat(self, factors):
+        if any(isinstance(f, EmptyRegex) for f in factors):
+            return EmptyRegex()
+        result = list()
+        for f in factors:
+            if isinstance(f, EpsilonRegex):
+                continue
+            if isinstance(f, StarRegex) and result and result[-1] is f:
+                continue
+            result.append(f)
+        return _concat(result)
+    
+    def __charset(self, re):
+        '''The bytes a character atom matches, or None'''
+        if not isinstance(re, CarRegex):
+            return None
+        if re.val not in self.charsets:
+            val = str(re.val)
+            if val.startswith("[") and val.endswith("]") and not val.startswith("[^"):
+                self.charsets[re.val] = hypothesis_dfa.parseCharset(val)
+            else:
+                self.charsets[re.val] = None
+        return self.charsets[re.val]
+    
+    def __plus(self, re):
+        '''r* if re is rr* or r*r, otherwise re'''
+        factors = _factors(re)
+        if len(factors) > 1:
+            if isinstance(factors[-1], StarRegex) and _concat(factors[:-1]) == factors[-1].re:
+                return factors[-1]
+            if isinstance(factors[0], StarRegex) and _concat(factors[1:]) == factors[0].re:
+                return factors[0]
+        return re
+    
+    def __union(self, branches):
+        '''Normalize the union of branches without recursion: __new_union
+        yields the branches of each union it needs, is sent the result, and
+        finally yields _Done'''
+        top = tuple(branches)
+        stack = list()
+        if top not in self.unions:
+            stack.append((top, self.__new_union(list(top))))
+        value = None
+        while stack:
+            key, steps = stack[-1]
+            item = steps.send(value)
+            value = None
+            if isinstance(item, _Done):
+                self.unions[key] = item.value
+                stack.pop()
+                value = item.value
+            elif tuple(item) in self.unions:
+                value = self.unions[tuple(item)]
+            else:
+                stack.append((tuple(item), self.__new_union(list(item))))
+        return self.unions[top]
+    
+    def __new_union(self, branches):
+        if EpsilonRegex() in branches:
+            branches = [self.__plus(b) for b in branches]
+        seen = set()
+        unique = list()
+        for b in branches:
+            if not isinstance(b, EmptyRegex) and b not in seen:
+                seen.add(b)
+                unique.append(b)
+        if EpsilonRegex() in seen and any(isinstance(b, StarRegex) for b in unique):
+            unique.remove(EpsilonRegex())
+        
+        # merge the character atoms where the first one was
+        atoms = [b for b in unique if self.__charset(b)]
+        if len(atoms) > 1:
+            chars = set()
+            for b in atoms:
+                chars |= self.__charset(b)
+            merged = CarRegex(lstar.LStar.list_to_charset([chr(c) for c in sorted(chars)]))
+            first = unique.index(atoms[0])
+            atoms = set(atoms)
+            unique = [b for b in unique if b not in atoms]
+            unique.insert(first, merged)
+        
+        # factoring one end can expose a shared factor at the other, so
+        # keep going while the union gets shorter
+        best = _union(unique)
+        while len(unique) > 1:
+            length = regexLength(best, lengths=self.lengths)
+            for end in [0, -1]:
+                # pass on the unions __factor needs
+                steps = self.__factor(unique, end)
+                item = next(steps)
+                while not isinstance(item, _Done):
+                    item = steps.send((yield item))
+                factored = item.value
+                if factored is not None and regexLength(factored, lengths=self.lengths) < length:
+                    best = factored
+                    length = regexLength(best, lengths=self.lengths)
+            if len(_branches(best)) == len(unique):
+                break
+            unique = _branches(best)
+        yield _Done(best)
+    
+    def __factor(self, branches, end):
+        '''Factor out the first (end 0) or last (end -1) factor shared by
+        several branches, or None if no branches share one.  Like
+        __new_union, this yields the branches of the unions it needs.'''
+        groups = collections.OrderedDict()
+        for b in branches:
+            factors = _factors(b)
+            groups.setdefault(factors[end], list()).append(factors)
+        if all(len(group) == 1 for group in groups.itervalues()):
+            yield _Done(None)
+            return
         
+        factored = list()
+        for shared, group in groups.iteritems():
+            if len(group) == 1:
+                factored.append(_concat(group[0]))
+                continue
+            # take the longest prefix or suffix of the group at once, so the
+            # union of what is left is only factored again where it splits
+            n = 1
+            shortest = min(len(f) for f in group)
+            if end == 0:
+                while n < shortest and all(f[n] is group[0][n] for f in group):
+                    n += 1
+                rest = yield [_concat(f[n:]) for f in group]
+                factored.append(self.__concat(group[0][:n] + _factors(rest)))
+            else:
+                while n < shortest and all(f[-n - 1] is group[0][-n - 1] for f in group):
+                    n += 1
+                rest = yield [_concat(f[:-n]) for f in group]
+                factored.append(self.__concat(_factors(rest) + group[0][-n:]))
+        yield _Done(_union(factored))
+
 class Machine(object):
+    '''The network as a sparse system of equations: state 0 is a dummy
+    start state and the others are numbered from 1 in network order.
+    A[i][j] is the label of the edge from i to j, only for edges that
+    exist, pred[j] is the set of states with an edge to j, and B[i] is eps
+    for reporting states and NULL for the rest.'''
     def __init__(self, an):
         '''an is an ANML network'''
         # we're going to add in a dummy start node
@@ -138,86 +527,54 @@ class Machine(object):
         if inspect.isclass(MNRLNetwork):
             self.__init_mnrl(an)
             return
-         
-        self.B = list()
-        self.B.append(EmptyRegex())
-        
-        for _,s in an.elements.iteritems():
-            if s.match:
-                self.B.append(EpsilonRegex())
-            else:
-                self.B.append(EmptyRegex())
         
-        self.A = list()
-        # first row is just the dummy start state
-        tmp_list = list()
-        tmp_list.append(EmptyRegex())
-        for _,s in an.elements.iteritems():
-            if s.startType == "start-of-data":
-                tmp_list.append(CarRegex(s.symbol))
-            else:
-                tmp_list.append(EmptyRegex())
-        self.A.append(tmp_list)
-        
-        # now go through all the states
-        for _,s in an.elements.iteritems():
-            tmp_list = list()
-            # handle the fake starting state
-            tmp_list.append(EmptyRegex())
-            
-            for _,j in an.elements.iteritems():
-                if j.anmlId in [x.anmlId for x,_ in s.getActivate()]:
-                    tmp_list.append(CarRegex(j.symbol))
-                else:
-                    tmp_list.append(EmptyRegex())
-            self.A.append(tmp_list)
+        elements = an.elements.values()
+        self.__build([s.anmlId for s in elements],
+                     [s.symbol for s in elements],
+                     [s.match for s in elements],
+                     [s.startType == "start-of-data" for s in elements],
+                     [[x.anmlId for x,_ in s.getActivate()] for s in elements])
     
     def __init_mnrl(self, mn):
         '''mn is a MNRL network'''
-        # This should mostly mirror above
-        self.B = list()
-        self.B.append(EmptyRegex())
+        nodes = mn.nodes.values()
+        self.__build([s.id for s in nodes],
+                     [s.symbols for s in nodes],
+                     [s.report for s in nodes],
+                     [s.enable == MNRLDefs.ENABLE_ON_START_AND_ACTIVATE_IN for s in nodes],
+                     [[x["id"] for x in s.getOutputConnections()[MNRLDefs.H_STATE_OUTPUT][1]] for s in nodes])
+    
+    def __build(self, ids, symbols, reports, starts, successors):
+        index = dict((node_id, k + 1) for k, node_id in enumerate(ids))
+        self.n = len(ids) + 1
         
-        for _,s in mn.nodes.iteritems():
-            if s.report:
-                self.B.append(EpsilonRegex())
-            else:
-                self.B.append(EmptyRegex())
-                
-        self.A = list()
-        # first row is just the dummy start state
-        tmp_list = list()
-        tmp_list.append(EmptyRegex())
-        for _,s in mn.nodes.iteritems():
-            if s.enable == MNRLDefs.ENABLE_ON_START_AND_ACTIVATE_IN:
-                tmp_list.append(CarRegex(s.symbols))
-            else:
-                tmp_list.append(EmptyRegex())
-        self.A.append(tmp_list)
+        self.B = [EmptyRegex()] + [EpsilonRegex() if report else EmptyRegex() for report in reports]
         
-        # now go through all the states
-        for _,s in mn.nodes.iteritems():
-            tmp_list = list()
-            # handle the fake starting state
-            tmp_list.append(EmptyRegex())
-            
-            for _,j in mn.nodes.iteritems():
-                if j.id in [x["id"] for x in s.getOutputConnections()[MNRLDefs.H_STATE_OUTPUT][1]]:
-                    tmp_list.append(CarRegex(j.symbols))
-                else:
-                    tmp_list.append(EmptyRegex())
-            self.A.append(tmp_list)
+        self.A = dict((i, dict()) for i in range(self.n))
+        self.pred = dict((i, set()) for i in range(self.n))
+        for k, start in enumerate(starts):
+            if start:
+                self.__add_edge(0, k + 1, CarRegex(symbols[k]))
+        for k, succ in enumerate(successors):
+            for node_id in succ:
+                if node_id in index:
+                    j = index[node_id]
+                    self.__add_edge(k + 1, j, CarRegex(symbols[j - 1]))
+    
+    def __add_edge(self, i, j, re):
+        self.A[i][j] = re
+        self.pred[j].add(i)
     
     def printB(self):
         print " ; ".join([str(b) for b in self.B])
     
     def printAdj(self):
-        for row in self.A:
-            print " ; ".join([str(a) for a in row])
+        for i in range(self.n):
+            print " ; ".join([str(self.A[i].get(j, EmptyRegex())) for j in range(self.n)])
     
     def __one_simplify(self, re):
       if isinstance(re, UnionRegex):
-        if re.re1 == re.re2:
+        if re.re1 is re.re2:
           re = re.re1
         elif isinstance(re.re1, UnionRegex):
           re = UnionRegex(re.re1.re1, UnionRegex(re.re1.re2, re.re2))
@@ -243,29 +600,150 @@ class Machine(object):
     
     @staticmethod
     def re_to_str(re):
-      stack = [re]
-      
-      while len(stack) != 0:
-        curr = stack.pop()
-         
+      '''re with minimal parentheses, see writeRegex'''
+      return regexString(re)
+    
+    def eliminationOrder(self, order=EliminationOrder.REVERSE):
+        '''The states other than the dummy start state 0, in the order in
+        which brzozowski() eliminates them'''
+        states = range(1, self.n)
+        if order == EliminationOrder.REVERSE:
+            return list(reversed(states))
+        
+        # the transition graph, with the length of each label
+        weight = dict(((i, j), re.length()) for i, row in self.A.iteritems() for j, re in row.iteritems())
+        
+        if order == EliminationOrder.SCC:
+            return self.__scc_order(weight)
+        if order == EliminationOrder.DEGREE:
+            cost = self.__degree_cost
+        elif order == EliminationOrder.WEIGHT:
+            cost = self.__weight_cost
+        else:
+            raise ValueError("unknown elimination order '{}'".format(order))
+        return self.__greedy_order(states, weight, cost)
+    
+    @staticmethod
+    def __degree_cost(weight, n, preds, succs):
+        return len(preds) * len(succs)
+    
+    @staticmethod
+    def __weight_cost(weight, n, preds, succs):
+        # how much longer the labels get when n is removed
+        loop = weight.get((n, n), 0)
+        cost = sum(weight[(i, n)] * (len(succs) - 1) for i in preds)
+        cost += sum(weight[(n, j)] * (len(preds) - 1) for j in succs)
+        cost += loop * (len(preds) * len(succs) - 1)
+        return cost
+    
+    def __greedy_order(self, states, weight, cost):
+        '''Repeatedly eliminate the cheapest state from the graph, adding
+        the new labels as if by brzozowski()'''
+        weight = dict(weight)
+        pred = [set() for _ in range(self.n)]
+        succ = [set() for _ in range(self.n)]
+        for i, j in weight:
+            if i != j:
+                succ[i].add(j)
+                pred[j].add(i)
+        
+        # the start state is never eliminated early
+        remaining = set(states)
+        order = list()
+        while remaining:
+            n = min(remaining, key=lambda n: (cost(weight, n, pred[n], succ[n]), n))
+            loop = weight.get((n, n), 0)
+            for i in pred[n]:
+                for j in succ[n]:
+                    weight[(i, j)] = weight.get((i, j), 0) + weight[(i, n)] + loop + weight[(n, j)]
+                    if i != j:
+                        succ[i].add(j)
+                        pred[j].add(i)
+            for i in pred[n]:
+                succ[i].discard(n)
+            for j in succ[n]:
+                pred[j].discard(n)
+            remaining.remove(n)
+            order.append(n)
+        return order
+    
+    def __scc_order(self, weight):
+        '''Tarjan's algorithm; its components come out in reverse
+        topological order, so the ones farthest from the start are first.
+        Within a component, states with fewer connections go first.'''
+        m = self.n
+        succ = [sorted(self.A[i]) for i in range(m)]
+        degree = [len(self.pred[i]) * len(succ[i]) for i in range(m)]
+        
+        index = dict()
+        low = dict()
+        stack = list()
+        on_stack = set()
+        components = list()
+        for root in range(m):
+            if root in index:
+                continue
+            work = [(root, 0)]
+            while work:
+                v, k = work.pop()
+                if k == 0:
+                    index[v] = low[v] = len(index)
+                    stack.append(v)
+                    on_stack.add(v)
+                if k < len(succ[v]):
+                    work.append((v, k + 1))
+                    w = succ[v][k]
+                    if w not in index:
+                        work.append((w, 0))
+                    elif w in on_stack:
+                        low[v] = min(low[v], index[w])
+                    continue
+                if low[v] == index[v]:
+                    component = list()
+                    while True:
+                        w = stack.pop()
+                        on_stack.remove(w)
+                        component.append(w)
+                        if w == v:
+                            break
+                    components.append(component)
+                if work:
+                    parent = work[-1][0]
+                    low[parent] = min(low[parent], low[v])
+        
+        order = list()
+        for component in components:
+            order.extend(sorted((n for n in component if n != 0), key=lambda n: degree[n]))
+        return order
     
-    def brzozowski(self):
-        logger.info("Constructing RE from automaton")
-        m = len(self.A)
-        A = copy.deepcopy(self.A)
-        b = copy.deepcopy(self.B)
-        for n in reversed(range(m)):
-            b[n] = self.__one_simplify(ConcatRegex(self.__one_simplify(StarRegex(A[n][n])), b[n]))
-            for j in range(n):
-                A[n][j] = self.__one_simplify(ConcatRegex(self.__one_simplify(StarRegex(A[n][n])),A[n][j]))
-            for i in range(n):
-                b[i] = self.__one_simplify(UnionRegex(b[i], self.__one_simplify(ConcatRegex(A[i][n],b[n]))))
-                for j in range(n):
-                    A[i][j] = self.__one_simplify(UnionRegex(A[i][j], self.__one_simplify(ConcatRegex(A[i][n],A[n][j]))))
-            for i in range(n):
-                A[i][n] = EmptyRegex()
+    def brzozowski(self, order=EliminationOrder.REVERSE, normalize=True):
+        logger.info("Constructing RE from automaton (%s elimination order)", order)
+        # regexes are immutable, so the rows can share them
+        A = dict((i, dict(row)) for i, row in self.A.iteritems())
+        pred = dict((i, set(p)) for i, p in self.pred.iteritems())
+        b = list(self.B)
+        # each step only visits the predecessors and successors of n
+        for n in self.eliminationOrder(order) + [0]:
+            loop = A[n].pop(n, EmptyRegex())
+            pred[n].discard(n)
+            star = self.__one_simplify(StarRegex(loop))
+            b[n] = self.__one_simplify(ConcatRegex(star, b[n]))
+            for j in A[n]:
+                A[n][j] = self.__one_simplify(ConcatRegex(star, A[n][j]))
+                pred[j].discard(n)
+            for i in pred[n]:
+                into = A[i].pop(n)
+                b[i] = self.__one_simplify(UnionRegex(b[i], self.__one_simplify(ConcatRegex(into, b[n]))))
+                for j, out in A[n].iteritems():
+                    A[i][j] = self.__one_simplify(UnionRegex(A[i].get(j, EmptyRegex()), self.__one_simplify(ConcatRegex(into, out))))
+                    pred[j].add(i)
+            del A[n]
+            del pred[n]
         #logger.debug("Unsimplified RE: %s", b[0])
         logger.info("Beginning simplification")
         b[0] = b[0].simplify()
-        logger.info("Done with simplification")
-        return b[0]
\ No newline at end of file
+        logger.info("Done with simplification; the regex has length %d", regexLength(b[0]))
+        if normalize:
+            b[0] = Normalizer().normalize(b[0])
+            logger.info("Done with normalization; the regex has length %d", regexLength(b[0]))
+        return b[0]
@@ -0,0 +1,69 @@
+# Checkpoints of a learning run
+#
+# Kevin Angstadt
+# University of Michigan
+
+import cPickle as pickle
+import logging, os, random
+
+logger = logging.getLogger(__name__)
+
+FILENAME = "checkpoint.pkl"
+
+# the answer journals this process has started or resumed
+_journals = set()
+
+def _journal(filename):
+    return filename + ".answers"
+
+def save(filename, learner, mat):
+    '''Write the state of learner and mat to filename.  The file is replaced
+    atomically so a crash never leaves a partial checkpoint behind.  The
+    membership answers the mat got since the last save are appended to a
+    journal next to it, so a save does not cost more as the cache grows.'''
+    state = dict([
+        ("learner", learner.getState()),
+        ("mat", mat.getState()),
+        ("random", random.getstate())
+    ])
+
+    # answers in the journal that a crash keeps out of the checkpoint are
+    # still true, so the journal is written first
+    journal = _journal(filename)
+    with open(journal, "ab" if journal in _journals else "wb") as f:
+        pickle.dump(mat.newAnswers(), f, pickle.HIGHEST_PROTOCOL)
+        f.flush()
+        os.fsync(f.fileno())
+    _journals.add(journal)
+
+    tmp = filename + ".tmp"
+    with open(tmp, "wb") as f:
+        pickle.dump(state, f, pickle.HIGHEST_PROTOCOL)
+    os.rename(tmp, filename)
+    logger.info("Saved checkpoint to %s", filename)
+
+def restore(filename, learner, mat):
+    '''Load the state saved in filename into learner and mat'''
+    with open(filename, "rb") as f:
+        state = pickle.load(f)
+
+    # read the journal up to the end of its last complete save
+    journal = _journal(filename)
+    answers = list()
+    if os.path.exists(journal):
+        with open(journal, "r+b") as f:
+            end = 0
+            while True:
+                try:
+                    answers.extend(pickle.load(f))
+                except (EOFError, pickle.UnpicklingError, ValueError):
+                    break
+                end = f.tell()
+            f.truncate(end)
+    _journals.add(journal)
+    state["mat"]["answers"] = answers
+
+    learner.setState(state["learner"])
+    mat.setState(state["mat"])
+    random.setstate(state["random"])
+    logger.info("Resumed from checkpoint %s", filename)
@@ -0,0 +1,97 @@
+# Counterexample shortening with membership queries
+#
+# Kevin Angstadt
+# University of Michigan
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+class CounterexampleMinimizer(object):
+    '''Shortens a counterexample to a HypothesisDFA while the kernel and the
+    hypothesis still disagree on it.  Each round tries, in one batch of
+    membership queries per step, cutting prefixes and suffixes and then
+    deleting blocks of halving sizes, and keeps the shortest string that
+    still disagrees.  Finally each character is replaced by the first
+    symbol of its class in the hypothesis, which makes the strings the
+    learner derives from it more likely to be cached.  At most budget
+    strings are checked per counterexample.'''
+    def __init__(self, mat, budget=1000):
+        self.mat = mat
+        self.budget = budget
+        self.queries = 0
+
+    def minimize(self, cex, dfa):
+        self.queries = 0
+        if any(c not in dfa.symbol_class for c in cex):
+            # such as the terminating NUL of a null-terminated kernel
+            logger.info("Not shortening a counterexample outside of the alphabet")
+            return cex
+
+        best = cex
+        while self.queries < self.budget:
+            shorter = self.__shorten(best, dfa)
+            if shorter is None:
+                break
+            best = shorter
+        best = self.__substitute(best, dfa)
+
+        logger.info("Shortened counterexample from %d to %d characters with %d queries",
+                    len(cex), len(best), self.queries)
+        return best
+
+    def __disagreeing(self, candidates, dfa):
+        '''The candidates the kernel and dfa disagree on, checking as many as
+        the budget allows'''
+        seen = set()
+        unique = list()
+        for c in candidates:
+            if c not in seen:
+                seen.add(c)
+                unique.append(c)
+        batch = unique[:max(self.budget - self.queries, 0)]
+        if not batch:
+            return list()
+        self.queries += len(batch)
+        answers = self.mat.isMemberBatch(batch)
+        return [c for c, answer in zip(batch, answers) if answer != dfa.accepts(c)]
+
+    def __shorten(self, s, dfa):
+        n = len(s)
+        steps = [
+            # cut a prefix or a suffix
+            [s[i:] for i in range(1, n + 1)] + [s[:j] for j in range(n)],
+        ]
+        size = n // 2
+        while size >= 1:
+            # delete a block of size characters
+            steps.append([s[:i] + s[i + size:] for i in range(1, n - size)])
+            size //= 2
+
+        for candidates in steps:
+            failed = self.__disagreeing(candidates, dfa)
+            if failed:
+                return min(failed, key=len)
+        return None
+
+    def __substitute(self, s, dfa):
+        canonical = [dfa.classes[dfa.symbol_class[c]][0] for c in s]
+        positions = [i for i, c in enumerate(s) if canonical[i] != c]
+        if not positions:
+            return s
+
+        whole = "".join(canonical)
+        if self.__disagreeing([whole], dfa):
+            return whole
+
+        # replace single characters, then keep every replacement that worked
+        # on its own if they also work together
+        candidates = [s[:i] + canonical[i] + s[i + 1:] for i in positions]
+        failed = set(self.__disagreeing(candidates, dfa))
+        if not failed:
+            return s
+        combined = "".join(canonical[i] if s[:i] + canonical[i] + s[i + 1:] in failed else c
+                           for i, c in enumerate(s))
+        if combined in failed or self.__disagreeing([combined], dfa):
+            return combined
+        return min(failed)
@@ -1,7 +1,7 @@
 #!/usr/bin/env python2
 import argparse, datetime, errno, logging, os, time
 import parsedatetime
-import lstar, cpabmcseqteacher
+import lstar, kearns_vazirani, cpabmcseqteacher, kernel_runner, checkpoint, alphabet_partition, equivalence_oracle, brzozowski
 
 logger = logging.getLogger()
 logger.setLevel(logging.DEBUG)
@@ -17,6 +17,72 @@ if __name__ == '__main__':
     parser.add_argument("--min-inp-length", default=1, type=int)
     parser.add_argument("--max-inp-length", default=-1, type=int)
     parser.add_argument("--null-terminated", action='store_true')
+    parser.add_argument("--workers", default=1, type=int,
+                        help="number of processes answering membership queries")
+    parser.add_argument("--sandbox", action='store_true',
+                        help="run the kernel in isolated workers with resource limits")
+    parser.add_argument("--kernel-cpu-time", default=1.0, type=float,
+                        help="CPU seconds per membership query in the sandbox")
+    parser.add_argument("--kernel-memory", default=None, type=int,
+                        help="address space limit in MB for sandboxed kernels")
+    parser.add_argument("--on-kernel-failure",
+                        default=kernel_runner.FailureVerdict.REJECT,
+                        choices=kernel_runner.FailureVerdict.ALL)
+    parser.add_argument("--native-batch", action='store_true',
+                        help="answer each batch of queries with one call into a generated C harness")
+    parser.add_argument("--optimize-kernel", action='store_true',
+                        help="build the batch harness with -O2 -march=native")
+    parser.add_argument("--cache-db", default=None,
+                        help="SQLite database that keeps membership answers across runs")
+    parser.add_argument("--resume", action='store_true',
+                        help="continue from the checkpoint in the output location")
+    parser.add_argument("--learner", default="lstar", choices=["lstar", "kv"])
+    parser.add_argument("--counterexample-mode",
+                        default=lstar.CounterexampleMode.ANGLUIN,
+                        choices=lstar.CounterexampleMode.ALL)
+    parser.add_argument("--symbolic", action='store_true',
+                        help="learn over classes of symbols, split as counterexamples demand")
+    parser.add_argument("--static-alphabet", action='store_true',
+                        help="start symbolic learning from classes found in the kernel source")
+    parser.add_argument("--equivalence-oracles",
+                        default=",".join(equivalence_oracle.OracleStage.ALL),
+                        help="comma-separated testing stages run before CPAChecker ({}); empty for none".format(
+                            ", ".join(equivalence_oracle.OracleStage.ALL)))
+    parser.add_argument("--random-walk-tests", default=10000, type=int,
+                        help="number of random walks per equivalence query")
+    parser.add_argument("--wp-depth", default=1, type=int,
+                        help="extra states the Wp-method allows for")
+    parser.add_argument("--cpachecker-daemon", action='store_true',
+                        help="keep one CPAChecker JVM running for all equivalence queries")
+    parser.add_argument("--portfolio", default=None,
+                        help="comma-separated CPAChecker configurations to race ({})".format(
+                            ", ".join(cpabmcseqteacher.CPA_CONFIGURATIONS)))
+    parser.add_argument("--length-bands", default=None,
+                        choices=cpabmcseqteacher.LengthBands.ALL,
+                        help="check ranges of input lengths in concurrent CPAChecker runs")
+    parser.add_argument("--harness-encoding", default=cpabmcseqteacher.HarnessEncoding.REGEX,
+                        choices=cpabmcseqteacher.HarnessEncoding.ALL,
+                        help="how the hypothesis is given to CPAChecker")
+    parser.add_argument("--elimination-order", default=brzozowski.EliminationOrder.AUTO,
+                        choices=brzozowski.EliminationOrder.ALL + [brzozowski.EliminationOrder.AUTO],
+                        help="order of state elimination when building the regex of a hypothesis")
+    parser.add_argument("--max-regex-length", default=1000000, type=int,
+                        help="longest regex to give CPAChecker before using the table encoding (-1 for no limit)")
+    parser.add_argument("--minimal-regex", action="store_true",
+                        help="write the regex with only the parentheses precedence needs")
+    parser.add_argument("--no-normalize-regex", action="store_true",
+                        help="do not shorten the regex by merging charsets and factoring unions")
+    parser.add_argument("--max-counterexamples", default=1, type=int,
+                        help="counterexamples to ask CPAChecker for in each equivalence query")
+    parser.add_argument("--counterexample-blocking", default=cpabmcseqteacher.CounterexampleBlocking.LENGTH,
+                        choices=cpabmcseqteacher.CounterexampleBlocking.ALL,
+                        help="how further counterexamples must differ from the ones found")
+    parser.add_argument("--minimize-counterexamples", action="store_true",
+                        help="shorten CPAChecker's counterexamples with membership queries")
+    parser.add_argument("--minimizer-budget", default=1000, type=int,
+                        help="membership queries for shortening each counterexample")
+    parser.add_argument("--band-jobs", default=None, type=int,
+                        help="concurrent CPAChecker runs for length bands (default: number of CPUs)")
     
     group = parser.add_mutually_exclusive_group()
     group.add_argument("--return-int", action='store_true')
@@ -79,11 +145,67 @@ if __name__ == '__main__':
                             min_inp_length=args.min_inp_length,
                             max_inp_length=args.max_inp_length,
                             return_bool=bool_return,
-                            null_terminated=args.null_terminated)
+                            null_terminated=args.null_terminated,
+                            workers=args.workers,
+                            sandbox=args.sandbox,
+                            kernel_cpu_time=args.kernel_cpu_time,
+                            kernel_memory=args.kernel_memory << 20 if args.kernel_memory is not None else None,
+                            on_kernel_failure=args.on_kernel_failure,
+                            native_batch=args.native_batch,
+                            optimize_kernel=args.optimize_kernel,
+                            cache_db=args.cache_db,
+                            oracles=[o for o in args.equivalence_oracles.split(",") if o],
+                            random_walk_tests=args.random_walk_tests,
+                            wp_depth=args.wp_depth,
+                            use_daemon=args.cpachecker_daemon,
+                            portfolio=args.portfolio.split(",") if args.portfolio else None,
+                            length_bands=args.length_bands,
+                            band_jobs=args.band_jobs,
+                            harness_encoding=args.harness_encoding,
+                            max_counterexamples=args.max_counterexamples,
+                            counterexample_blocking=args.counterexample_blocking,
+                            minimize_counterexamples=args.minimize_counterexamples,
+                            minimizer_budget=args.minimizer_budget,
+                            elimination_order=args.elimination_order,
+                            max_regex_length=args.max_regex_length,
+                            minimal_regex=args.minimal_regex,
+                            normalize_regex=not args.no_normalize_regex)
 
-    learner = lstar.LStar(alphabet, mat, verbose=lstar.LStarUtil.loud, seed=0, emit_mnrl=True)
+    checkpoint_file = os.path.join(args.outputlocation, checkpoint.FILENAME)
 
-    machine = learner.learn()
+    if args.static_alphabet:
+      partition = mat.staticAlphabetPartition()
+    elif args.symbolic:
+      partition = alphabet_partition.AlphabetPartition(alphabet)
+    else:
+      partition = None
+
+    if args.learner == "kv":
+      learner = kearns_vazirani.KearnsVazirani(alphabet, mat, verbose=lstar.LStarUtil.loud, seed=0, emit_mnrl=True,
+                                               checkpoint_file=checkpoint_file,
+                                               partition=partition)
+    else:
+      learner = lstar.LStar(alphabet, mat, verbose=lstar.LStarUtil.loud, seed=0, emit_mnrl=True,
+                            counterexample_mode=args.counterexample_mode,
+                            checkpoint_file=checkpoint_file,
+                            partition=partition)
+
+    if args.resume:
+      if os.path.exists(checkpoint_file):
+        checkpoint.restore(checkpoint_file, learner, mat)
+      else:
+        logger.warning("No checkpoint found in %s, starting from scratch", args.outputlocation)
+
+    # let the testing stages keep the learner's symbol classes apart
+    mat.partition = learner.partition
+
+    try:
+      machine = learner.learn()
+    except kernel_runner.KernelFailure as e:
+      logger.error("Aborting: %s", e)
+      raise SystemExit(1)
+    finally:
+      mat.close()
     
     machine.exportToFile(os.path.join(args.outputlocation, "final_automaton.mnrl"))
 
@@ -1,11 +1,71 @@
 from __future__ import print_function
 
-import ctypes, logging, sys, os, time
+import collections, logging, multiprocessing, signal, sys, os, time
 import tempfile, subprocess, re, shutil, errno, time
 import lstar, minimally_adequate_teacher, tempdir, chdir, anml, brzozowski, deadstate, logging_subprocess as lsubprocess, timeout
+import kernel_runner, membership_cache, static_alphabet, alphabet_partition, hypothesis_dfa, equivalence_oracle
+import cpachecker_daemon, counterexample_minimizer
 
 logger = logging.getLogger(__name__)
 
+# CPAChecker options of each configuration the equivalence check can use;
+# the first one is used unless a portfolio is requested
+CPA_CONFIGURATIONS = collections.OrderedDict([
+    ("bmc-seq", ["-bmc-incremental",
+                 "-setprop", "solver.z3.stringSolver=seq"]),
+    ("bmc-z3str3", ["-bmc-incremental",
+                    "-setprop", "solver.z3.stringSolver=z3str3"]),
+    ("bmc-double", ["-bmc-incremental",
+                    "-setprop", "solver.z3.stringSolver=seq",
+                    "-setprop", "cpa.loopbound.maxLoopIterationAdjusterFactory=DOUBLE"]),
+    ("kinduction", ["-kInduction",
+                    "-setprop", "solver.z3.stringSolver=seq"]),
+    ("predicate", ["-predicateAnalysis",
+                   "-setprop", "solver.z3.stringSolver=seq"]),
+])
+
+# regexes up to this length are also written to the debug log
+LOGGED_REGEX_LENGTH = 10000
+
+class HarnessEncoding(object):
+    # the hypothesis as a regex for __VERIFIER_inregex
+    REGEX = "regex"
+    # the hypothesis as a C transition table
+    TABLE = "table"
+    
+    ALL = [REGEX, TABLE]
+
+class CounterexampleBlocking(object):
+    # later counterexamples have lengths not seen yet
+    LENGTH = "length"
+    # later counterexamples are different strings
+    STRING = "string"
+    # later counterexamples disagree the other way around
+    DIRECTION = "direction"
+    
+    ALL = [LENGTH, STRING, DIRECTION]
+
+class LengthBands(object):
+    # one band for each length
+    SINGLE = "single"
+    # bands of 1, 2, 4, ... lengths
+    DOUBLING = "doubling"
+    
+    ALL = [SINGLE, DOUBLING]
+
+def lengthBands(min_length, max_length, mode):
+    """Split min_length..max_length into (lo, hi) bands, shortest first"""
+    bands = list()
+    lo = min_length
+    width = 1
+    while lo <= max_length:
+        hi = min(lo + width - 1, max_length)
+        bands.append((lo, hi))
+        lo = hi + 1
+        if mode == LengthBands.DOUBLING:
+            width *= 2
+    return bands
+
 class CpaBmcSeqMat(minimally_adequate_teacher.MinimallyAdequateTeacher):
     def __init__(self,
                src_dir,
@@ -18,8 +78,63 @@ class CpaBmcSeqMat(minimally_adequate_teacher.MinimallyAdequateTeacher):
                min_inp_length=1,
                max_inp_length=-1,
                return_bool=False,
-               null_terminated=False):
-        """src_dir should contain the kernel"""
+               null_terminated=False,
+               workers=1,
+               sandbox=False,
+               kernel_cpu_time=1.0,
+               kernel_memory=None,
+               on_kernel_failure=kernel_runner.FailureVerdict.REJECT,
+               native_batch=False,
+               optimize_kernel=False,
+               cache_db=None,
+               oracles=None,
+               random_walk_tests=10000,
+               wp_depth=1,
+               use_daemon=False,
+               portfolio=None,
+               length_bands=None,
+               band_jobs=None,
+               harness_encoding=HarnessEncoding.REGEX,
+               max_counterexamples=1,
+               counterexample_blocking=CounterexampleBlocking.LENGTH,
+               minimize_counterexamples=False,
+               minimizer_budget=1000,
+               elimination_order=brzozowski.EliminationOrder.AUTO,
+               max_regex_length=1000000,
+               minimal_regex=False,
+               normalize_regex=True):
+        """src_dir should contain the kernel.  With more than one worker,
+        batches of membership queries are spread over a pool of processes.
+        In sandbox mode, the kernel runs in separate workers limited to
+        kernel_cpu_time seconds per query and kernel_memory bytes, and
+        failing queries are answered according to on_kernel_failure.  With
+        native_batch, a generated harness answers each batch in one foreign
+        call; optimize_kernel builds it with -O2 -march=native.  If cache_db
+        names an SQLite database, membership answers are kept there across
+        runs of the same kernel.  oracles lists the equivalence_oracle
+        stages that test each hypothesis against the kernel, in order,
+        before CPAChecker is run.  With use_daemon, CPAChecker runs in one
+        long-lived JVM instead of a new cpa.sh process per query.  If
+        portfolio lists several CPA_CONFIGURATIONS, they race in parallel and
+        the first definitive verdict is used.  With length_bands (one of
+        LengthBands.ALL) and a maximum input length, the lengths are checked
+        in separate concurrent runs, band_jobs at a time.  harness_encoding
+        (one of HarnessEncoding.ALL) decides how the hypothesis is written
+        into the verification harness.  With max_counterexamples above one,
+        a failed check is followed by further runs that block the
+        counterexamples found so far (by counterexample_blocking, one of
+        CounterexampleBlocking.ALL), and the extra counterexamples are
+        handed to the learner.  With minimize_counterexamples, CPAChecker's
+        counterexamples are shortened with at most minimizer_budget
+        membership queries each before the learner sees them.
+        elimination_order (one of brzozowski.EliminationOrder.ALL, or AUTO
+        to keep the shortest regex of all of them) decides how the regex of
+        the hypothesis is built.  A regex longer than max_regex_length
+        characters (if not negative) is replaced by the table encoding.
+        With minimal_regex, the regex is written with only the parentheses
+        that precedence needs instead of fully parenthesized.  Unless
+        normalize_regex is False, the regex is shortened by
+        brzozowski.Normalizer before it is used."""
         super(CpaBmcSeqMat, self).__init__()
         
         print(src_dir)
@@ -38,8 +153,77 @@ class CpaBmcSeqMat(minimally_adequate_teacher.MinimallyAdequateTeacher):
         
         self.start_time = time.time()
         
+        if portfolio is None:
+            portfolio = list(CPA_CONFIGURATIONS)[:1]
+        for name in portfolio:
+            if name not in CPA_CONFIGURATIONS:
+                raise ValueError("unknown CPAChecker configuration '{}'".format(name))
+        self.portfolio = portfolio
+        
+        if length_bands is not None and max_inp_length < 0:
+            logger.warning("Length bands need a maximum input length; checking all lengths at once")
+            length_bands = None
+        if length_bands is not None and len(portfolio) > 1:
+            logger.warning("Length bands only use the %s configuration of the portfolio", portfolio[0])
+        self.length_bands = length_bands
+        self.harness_encoding = harness_encoding
+        self.elimination_order = elimination_order
+        self.max_regex_length = max_regex_length
+        self.minimal_regex = minimal_regex
+        self.normalize_regex = normalize_regex
+        self.max_counterexamples = max_counterexamples
+        self.counterexample_blocking = counterexample_blocking
+        # counterexamples of the last query besides the returned one
+        self.additional = list()
+        
+        self.minimizer = None
+        if minimize_counterexamples:
+            self.minimizer = counterexample_minimizer.CounterexampleMinimizer(self, minimizer_budget)
+        self.band_jobs = band_jobs if band_jobs is not None else multiprocessing.cpu_count()
+        
+        self.daemon = None
+        if use_daemon and (len(portfolio) > 1 or length_bands is not None):
+            logger.warning("The CPAChecker daemon runs one check at a time; ignoring it")
+        elif use_daemon:
+            self.daemon = cpachecker_daemon.CPAcheckerDaemon(self.cpachecker,
+                                                             os.path.join(self.log_dir, "cpachecker-daemon"))
+        
         logger.info("Logging dir: %s", self.log_dir)
         
+        # classes of symbols the testing stages keep apart, if known
+        self.partition = None
+        
+        # (stats name, oracle) for each stage before CPAChecker
+        self.oracles = list()
+        for stage in oracles or []:
+            if stage == equivalence_oracle.OracleStage.CACHED_ANSWERS:
+                oracle = equivalence_oracle.CachedAnswersOracle(self,
+                                                                min_length=min_inp_length,
+                                                                max_length=max_inp_length)
+            elif stage == equivalence_oracle.OracleStage.RANDOM_WALK:
+                oracle = equivalence_oracle.RandomWalkOracle(self, tests=random_walk_tests, seed=0,
+                                                             min_length=min_inp_length,
+                                                             max_length=max_inp_length)
+            elif stage == equivalence_oracle.OracleStage.WP_METHOD:
+                oracle = equivalence_oracle.WpMethodOracle(self, depth=wp_depth,
+                                                           min_length=min_inp_length,
+                                                           max_length=max_inp_length)
+            else:
+                raise ValueError("unknown equivalence oracle '{}'".format(stage))
+            self.oracles.append((stage.replace("-", "_"), oracle))
+        
+        for name in [name for name, _ in self.oracles] + ["cpachecker"]:
+            self.stats[name + "_checks"] = 0
+            self.stats[name + "_hits"] = 0
+            self.stats[name + "_time"] = 0.0
+        self.stats["additional_counterexamples"] = 0
+        self.stats["cpachecker_daemon_failures"] = 0
+        self.stats["regex_chars"] = 0
+        self.stats["minimized_counterexamples"] = 0
+        self.stats["minimizer_queries"] = 0
+        self.stats["cex_length_before"] = 0
+        self.stats["cex_length_after"] = 0
+        
         self.alphabet = alphabet
         
         logger.debug("The alphabet is: %s", self.alphabet)
@@ -49,6 +233,12 @@ class CpaBmcSeqMat(minimally_adequate_teacher.MinimallyAdequateTeacher):
         #copy the kernel
         shutil.copy(os.path.join(self.src_dir, self.kernel_file), self.log_dir)
         
+        if cache_db is not None:
+            with open(os.path.join(self.src_dir, self.kernel_file), "r") as f:
+                key = membership_cache.fingerprint(f.read(), self.kernel_function, return_bool, self.min_inp_length)
+            logger.info("Using membership cache %s (kernel %s)", cache_db, key)
+            self.cache = membership_cache.PersistentCache(os.path.abspath(cache_db), key)
+        
         with chdir.ChDir(self.log_dir) as tdir:
             # kernel_wrapper = "kernel_wrapper.c"
             # 
@@ -76,12 +266,121 @@ class CpaBmcSeqMat(minimally_adequate_teacher.MinimallyAdequateTeacher):
             lsubprocess.call(gcc_command, logger)
             #raw_input("check kernel!")
             
-            self.so = ctypes.cdll.LoadLibrary(os.path.abspath("kernel.so"))
-            self.c_kernel = getattr(self.so, self.kernel_function)
-            self.c_kernel.argtypes = [ctypes.c_char_p]
-            self.c_kernel.restype = ctypes.c_bool if return_bool else ctypes.c_int
+            so_path = os.path.abspath("kernel.so")
             
+            batch_so_path = None
+            if native_batch:
+                logger.info("Compiling batch harness")
+                kernel_runner.writeBatchHarness("kernel_batch.c", self.kernel_file, self.kernel_function)
+                gcc_command = ["gcc", "-iquote{}".format(self.src_dir), "-fPIC", "-shared"]
+                if optimize_kernel:
+                    gcc_command += ["-O2", "-march=native"]
+                gcc_command += ["-o", "kernel_batch.so", "kernel_batch.c"]
+                lsubprocess.call(gcc_command, logger)
+                batch_so_path = os.path.abspath("kernel_batch.so")
             
+            self.sandbox = sandbox
+            if sandbox:
+                if native_batch:
+                    logger.warning("The sandbox runs one query at a time; ignoring the batch harness")
+                self.runner = kernel_runner.SandboxRunner(so_path, self.kernel_function, return_bool, workers,
+                                                          cpu_time=kernel_cpu_time,
+                                                          memory=kernel_memory,
+                                                          on_failure=on_kernel_failure)
+            elif workers > 1:
+                self.runner = kernel_runner.PoolRunner(so_path, self.kernel_function, return_bool, workers,
+                                                       batch_so_path=batch_so_path)
+            elif native_batch:
+                self.runner = kernel_runner.NativeBatchRunner(batch_so_path)
+            else:
+                self.runner = kernel_runner.InProcessRunner(so_path, self.kernel_function, return_bool)
+            
+            
+    def close(self):
+        self.runner.close()
+        if self.daemon is not None:
+            self.daemon.close()
+        if isinstance(self.cache, membership_cache.PersistentCache):
+            self.cache.close()
+    
+    def staticAlphabetPartition(self):
+        """Preprocess the copied kernel and partition the alphabet by the
+        constants the kernel compares its input against"""
+        with chdir.ChDir(self.log_dir) as tdir:
+            gcc_command = ["gcc", "-E", "-iquote{}".format(self.src_dir), "-o", "kernel.i", self.kernel_file]
+            if lsubprocess.call(gcc_command, logger) != 0:
+                logger.warning("Could not preprocess the kernel; using the full alphabet")
+                return alphabet_partition.AlphabetPartition(self.alphabet, [[a] for a in self.alphabet])
+            with open("kernel.i", "r") as f:
+                source = f.read()
+        self.partition = static_alphabet.partition(source, self.alphabet)
+        return self.partition
+    
+    def getState(self):
+        state = super(CpaBmcSeqMat, self).getState()
+        # the time budget keeps running across a resume
+        state["elapsed"] = time.time() - self.start_time
+        return state
+    
+    def setState(self, state):
+        super(CpaBmcSeqMat, self).setState(state)
+        self.start_time = time.time() - state["elapsed"]
+    
+    def getStats(self):
+        if self.sandbox:
+            self.stats['kernel_failures'] = len(self.runner.failures)
+        for name in [name for name, _ in self.oracles] + ["cpachecker"]:
+            checks = self.stats[name + "_checks"]
+            self.stats[name + "_hit_rate"] = round(float(self.stats[name + "_hits"]) / checks, 3) if checks else 0.0
+        before = self.stats["cex_length_before"]
+        self.stats["cex_length_ratio"] = round(float(self.stats["cex_length_after"]) / before, 3) if before else 1.0
+        return super(CpaBmcSeqMat, self).getStats()
+    
+    def __record_stage(self, name, start, found):
+        self.stats[name + "_checks"] += 1
+        if found:
+            self.stats[name + "_hits"] += 1
+        self.stats[name + "_time"] = round(self.stats[name + "_time"] + time.time() - start, 2)
+    
+    def __minimize(self, cex, dfa):
+        shorter = self.minimizer.minimize(cex, dfa)
+        self.stats["minimized_counterexamples"] += 1
+        self.stats["minimizer_queries"] += self.minimizer.queries
+        self.stats["cex_length_before"] += len(cex)
+        self.stats["cex_length_after"] += len(shorter)
+        return shorter
+    
+    def __shortest_regex(self, br, running_limit):
+        """Build the regex in every elimination order, giving each an equal
+        share of the time that is left, and return the shortest"""
+        orders = brzozowski.EliminationOrder.ALL
+        deadline = time.time() + running_limit
+        best = None
+        for k, order in enumerate(orders):
+            if self.time_limit != 0:
+                share = int((deadline - time.time()) / (len(orders) - k))
+                if share < 1:
+                    break
+            else:
+                share = 0
+            try:
+                with timeout.timeout(share):
+                    regex = br.brzozowski(order, self.normalize_regex)
+            except timeout.TimeoutError:
+                logger.info("The %s elimination order ran out of time", order)
+                continue
+            length = brzozowski.regexLength(regex, self.minimal_regex)
+            logger.info("The %s elimination order gives a regex of length %d", order, length)
+            if best is None or length < best[2]:
+                best = (order, regex, length)
+        if best is None:
+            raise timeout.TimeoutError()
+        
+        logger.info("Using the %s elimination order", best[0])
+        key = "elimination_order_" + best[0]
+        self.stats[key] = self.stats.get(key, 0) + 1
+        return best[1]
+    
     def isMember(self, inp):
         super(CpaBmcSeqMat, self).isMember(inp)
         
@@ -95,21 +394,62 @@ class CpaBmcSeqMat(minimally_adequate_teacher.MinimallyAdequateTeacher):
               # Short-circuit
               return self.addCache(inp,False)
               
-            ret = bool(self.c_kernel(inp))
-            return self.addCache(inp,ret)
+            ret = self.runner.run(inp)
+            self.__add_answers([inp], [ret])
+            return ret
 
         else:
             return cached
     
+    def isMemberBatch(self, strings):
+        """Answers cached queries directly and sends the rest to the kernel
+        runner as one batch"""
+        self.stats['member_queries'] += len(strings)
+        
+        missing = list()
+        pending = set()
+        for inp in strings:
+            if inp in pending:
+                # the first occurrence in this batch already missed
+                self.stats['cache_hits'] += 1
+                continue
+            if self.getChache(inp) is None:
+                if len(inp) < self.min_inp_length:
+                    # Short-circuit
+                    self.addCache(inp,False)
+                else:
+                    pending.add(inp)
+                    missing.append(inp)
+        
+        self.__add_answers(missing, self.runner.runBatch(missing))
+        
+        return [self.cache[inp] for inp in strings]
+    
+    def __add_answers(self, inps, answers):
+        """Cache the kernel's answers to inps.  The verdict for a sandboxed
+        run that crashed or hit its limits is not an answer about the
+        kernel, so it is never written to a persistent cache."""
+        failed = set(self.runner.failed) if self.sandbox else set()
+        for i, (inp, ret) in enumerate(zip(inps, answers)):
+            if i in failed and isinstance(self.cache, membership_cache.PersistentCache):
+                self.cache.remember(inp, ret)
+            else:
+                self.addCache(inp,ret)
+    
     
     def isEquivalent(self,anml):
         """Uses CPAChecker to try to find a counterexample quickly"""
         super(CpaBmcSeqMat, self).isEquivalent(anml)
         
         query_number = self.getStats()['equivalence_queries']
+        self.additional = list()
         
         logger.info("Checking if equivalent [%d]", query_number)
         
+        # save what we have learned before the long verification run
+        if isinstance(self.cache, membership_cache.PersistentCache):
+            self.cache.flush()
+        
         #use the query_number to store the equivalence logs
         cur_dir = self.log_dir + "/equivalent-{}".format(str(query_number))
         try:
@@ -126,8 +466,29 @@ class CpaBmcSeqMat(minimally_adequate_teacher.MinimallyAdequateTeacher):
         deadstate.removeDeadStates(anml)
         logger.info("{} states in candidate".format(len(anml.nodes)))
         
+        # cheap tests against the kernel before the model checker
+        dfa = None
+        if self.oracles:
+            dfa = hypothesis_dfa.HypothesisDFA(anml, self.alphabet,
+                                               self.partition.classes if self.partition is not None else None)
+            for name, oracle in self.oracles:
+                start = time.time()
+                cex = oracle.findCounterexample(dfa)
+                self.__record_stage(name, start, cex is not None)
+                if cex is not None:
+                    logger.info("%s found a counterexample (hex): %s", name, "".join("{:02x}".format(ord(c)) for c in cex))
+                    return (False, cex)
+                logger.info("%s found no counterexample", name)
+        
         # first, we need to get the regular expression from the state machine
-        br = brzozowski.Machine(anml)
+        # (or a transition table)
+        if self.harness_encoding == HarnessEncoding.TABLE:
+            br = None
+            hypothesis = hypothesis_dfa.HypothesisDFA(anml, self.alphabet)
+            logger.info("Encoding the machine as a table of %d states and %d symbol classes",
+                        len(hypothesis), len(hypothesis.classes))
+        else:
+            br = brzozowski.Machine(anml)
         
         # logger.debug("Adj:\n{}", "\n".join([" ; ".join([str(a) for a in row]) for row in br.A]))
         # logger.debug("B:\n{}", " ; ".join([str(b) for b in br.B]))
@@ -139,9 +500,25 @@ class CpaBmcSeqMat(minimally_adequate_teacher.MinimallyAdequateTeacher):
             now = time.time()
             running_limit = int(self.time_limit - (now - self.start_time))
             
-            with timeout.timeout(running_limit):
-              regex = str(br.brzozowski())
-              logger.info("The machine represents: %s", regex)
+            if br is not None:
+              if self.elimination_order == brzozowski.EliminationOrder.AUTO:
+                regex = self.__shortest_regex(br, running_limit)
+              else:
+                with timeout.timeout(running_limit):
+                  regex = br.brzozowski(self.elimination_order, self.normalize_regex)
+              length = brzozowski.regexLength(regex, self.minimal_regex)
+              logger.info("The regex of the machine has length %d", length)
+              if self.max_regex_length >= 0 and length > self.max_regex_length:
+                hypothesis = hypothesis_dfa.HypothesisDFA(anml, self.alphabet)
+                logger.warning("The regex is too long; encoding the machine as a table of %d states and %d symbol classes",
+                               len(hypothesis), len(hypothesis.classes))
+                self.stats["table_fallbacks"] = self.stats.get("table_fallbacks", 0) + 1
+              else:
+                hypothesis = regex
+                self.stats["regex_chars"] += length
+                # longer regexes are only written into kernel_equiv.c
+                if length <= LOGGED_REGEX_LENGTH:
+                  logger.debug("The machine represents: %s", brzozowski.regexString(regex, self.minimal_regex))
             
             language_regex = "({})*".format(lstar.LStar.list_to_charset(self.alphabet))
             
@@ -157,30 +534,7 @@ class CpaBmcSeqMat(minimally_adequate_teacher.MinimallyAdequateTeacher):
             with chdir.ChDir(cur_dir):
                 kernel_equiv = "kernel_equiv.c"
                 
-                shutil.copy(os.path.join(self.log_dir, self.kernel_file), kernel_equiv)
-                
-                with open(kernel_equiv, "a") as of:
-                    print("extern int __VERIFIER_assume(int);", file=of)
-                    print("extern int __VERIFIER_inregex(char*, char*);", file=of)
-                    print("extern int __VERIFIER_maxstrlen(char*, int);", file=of)
-                    print("extern int __VERIFIER_minstrlen(char*, int);", file=of)
-                    print("int __cpa_equiv(char* input) {", file=of)
-                    if len(self.alphabet) < 256 or self.null_terminated:
-                      print("  __VERIFIER_assume(__VERIFIER_inregex(input, \"{0}\"));".format(language_regex), file=of)
-                    if self.max_inp_length >= 0:
-                      print("  __VERIFIER_assume(__VERIFIER_maxstrlen(input, {}));".format(self.max_inp_length), file=of)
-                    if self.min_inp_length >= 0:
-                      print("  __VERIFIER_assume(__VERIFIER_minstrlen(input, {}));".format(self.min_inp_length), file=of)
-                    print("  int retval = {0}(input);".format(self.kernel_function), file=of)
-                    print("  if (retval) {", file=of)
-                    print("    __VERIFIER_assume(!__VERIFIER_inregex(input, \"{0}\"));".format(regex), file=of)
-                    print("    goto ERROR;", file=of)
-                    print("  } else {", file=of)
-                    print("    __VERIFIER_assume(__VERIFIER_inregex(input, \"{0}\"));".format(regex), file=of)
-                    print("    goto ERROR;", file=of)
-                    print("  }", file=of)
-                    print("  ERROR: return retval;", file=of)
-                    print("}", file=of)
+                self._write_harness(kernel_equiv, hypothesis, language_regex, self.min_inp_length, self.max_inp_length)
                     
                 # figure out our remaining time limit
                 now = time.time()
@@ -191,30 +545,34 @@ class CpaBmcSeqMat(minimally_adequate_teacher.MinimallyAdequateTeacher):
                     logger.info("Out of time")
                     return (True, None)
                 
-                cpa_invocation = [
-                    self.cpachecker,
-                    "-stack", "1000m",
-                    "-bmc-incremental",
-                    "-setprop", "solver.solver=z3",
-                    "-setprop", "solver.z3.stringSolver=seq",
-                    "-setprop", "cpa.predicate.handlePointerAliasing=false",
-                    "-setprop", "analysis.entryFunction=__cpa_equiv",
-                    "-setprop", "counterexample.export.model=Counterexample.%d.assignment.txt",
-                    "-setprop", "counterexample.export.formula=Counterexample.%d.smt2",
-                    "-setprop", "limits.time.cpu={}s".format(running_limit if self.time_limit != 0 else "-1n"),
-                    "-preprocess",
-                    os.path.abspath(kernel_equiv)
-                ]
+                cpa_options = self._cpa_options(running_limit)
                 
-                logger.debug("calling: {}".format(" ".join(cpa_invocation)))
-                
-                lsubprocess.call(cpa_invocation, logger)
+                start = time.time()
+                if self.length_bands is not None:
+                    self._run_bands(hypothesis, language_regex, cpa_options, running_limit)
+                else:
+                    self._run_cpachecker(cpa_options + [os.path.abspath(kernel_equiv)], running_limit)
                 
                 result = self._check_verification_status(os.path.abspath("./output"))
+                self.__record_stage("cpachecker", start, result == "FALSE")
                 
                 if result == "FALSE":
                     cex = self._extract_counter_example(os.path.abspath("./output"))
                     logger.info("Suggested CPAChecker cex (hex): {}".format("".join("{:02x}".format(ord(c)) for c in cex)))
+                    if self.max_counterexamples > 1:
+                        self.additional = self._more_counterexamples(hypothesis, language_regex, cex)
+                    if self.minimizer is not None:
+                        if dfa is None:
+                            dfa = hypothesis_dfa.HypothesisDFA(anml, self.alphabet,
+                                                               self.partition.classes if self.partition is not None else None)
+                        cex = self.__minimize(cex, dfa)
+                        shortened = [cex]
+                        for c in self.additional:
+                            c = self.__minimize(c, dfa)
+                            if c not in shortened:
+                                shortened.append(c)
+                        self.additional = shortened[1:]
+                        logger.info("Shortened cex (hex): {}".format("".join("{:02x}".format(ord(c)) for c in cex)))
                     logger.info("Found counterexample, running another loop.")
                     return (False, cex)
                 elif result == "UNKNOWN":
@@ -228,6 +586,293 @@ class CpaBmcSeqMat(minimally_adequate_teacher.MinimallyAdequateTeacher):
         #c = raw_input("Provide counterexample [Leave empty for equivalent]: ").strip()
         return (True, None)
     
+    def additionalCounterexamples(self):
+        return list(self.additional)
+    
+    def _cpa_options(self, running_limit):
+        """CPAChecker options for checking kernel_equiv.c within running_limit
+        seconds, without the configuration and the file to check"""
+        return [
+            "-setprop", "solver.solver=z3",
+            "-setprop", "cpa.predicate.handlePointerAliasing=false",
+            "-setprop", "analysis.entryFunction=__cpa_equiv",
+            "-setprop", "counterexample.export.model=Counterexample.%d.assignment.txt",
+            "-setprop", "counterexample.export.formula=Counterexample.%d.smt2",
+            "-setprop", "limits.time.cpu={}s".format(running_limit if self.time_limit != 0 else "-1n"),
+            "-preprocess"
+        ]
+    
+    def _more_counterexamples(self, hypothesis, language_regex, cex):
+        """Ask CPAChecker for up to max_counterexamples - 1 counterexamples
+        besides cex, each run in a more-N directory of the current one with
+        the counterexamples found so far blocked.  Stops at the first run
+        without a new counterexample."""
+        found = [cex]
+        while len(found) < self.max_counterexamples:
+            now = time.time()
+            running_limit = int(self.time_limit - (now - self.start_time))
+            if running_limit < 0 and self.time_limit != 0:
+                logger.info("Out of time for further counterexamples")
+                break
+            
+            blocked = [(s, self.isMember(s)) for s in found]
+            if self.counterexample_blocking == CounterexampleBlocking.DIRECTION and \
+                    len(set(accepted for _, accepted in blocked)) == 2:
+                break
+            
+            more_dir = os.path.abspath("more-{}".format(len(found)))
+            try:
+                os.makedirs(more_dir)
+            except OSError as exception:
+                if exception.errno != errno.EEXIST:
+                    raise
+            
+            with chdir.ChDir(more_dir):
+                kernel_equiv = "kernel_equiv.c"
+                self._write_harness(kernel_equiv, hypothesis, language_regex,
+                                    self.min_inp_length, self.max_inp_length, blocked)
+                
+                start = time.time()
+                self._run_cpachecker(self._cpa_options(running_limit) + [os.path.abspath(kernel_equiv)], running_limit)
+                result = self._check_verification_status(os.path.abspath("./output"))
+                more = self._extract_counter_example(os.path.abspath("./output")) if result == "FALSE" else None
+                if more in found:
+                    more = None
+                self.__record_stage("cpachecker", start, more is not None)
+            
+            if more is None:
+                logger.info("No further counterexample (%s)", result)
+                break
+            logger.info("Further CPAChecker cex (hex): {}".format("".join("{:02x}".format(ord(c)) for c in more)))
+            found.append(more)
+            self.stats["additional_counterexamples"] += 1
+        
+        return found[1:]
+    
+    def _write_harness(self, filename, hypothesis, language_regex, min_length, max_length, blocked=()):
+        """Write the kernel and an __cpa_equiv entry point that reaches ERROR
+        on inputs of min_length to max_length characters where the kernel
+        and hypothesis disagree.  hypothesis is either a regex or a
+        HypothesisDFA, which is written out as a transition table.  A regex
+        is streamed into the file rather than built as a string.  blocked
+        lists (counterexample, kernel answer) pairs that are ruled out
+        according to counterexample_blocking."""
+        block_lengths = list()
+        block_strings = list()
+        block_answers = set()
+        for s, accepted in blocked:
+            if self.counterexample_blocking == CounterexampleBlocking.LENGTH:
+                block_lengths.append(len(s))
+            elif self.counterexample_blocking == CounterexampleBlocking.STRING:
+                block_strings.append(s)
+            else:
+                block_answers.add(bool(accepted))
+        
+        shutil.copy(os.path.join(self.log_dir, self.kernel_file), filename)
+        
+        def write_accepts(of, before, after):
+            of.write(before)
+            if isinstance(hypothesis, hypothesis_dfa.HypothesisDFA):
+                of.write("__hypothesis(input)")
+            else:
+                of.write("__VERIFIER_inregex(input, \"")
+                brzozowski.writeRegex(hypothesis, of, self.minimal_regex)
+                of.write("\")")
+            of.write(after)
+        
+        with open(filename, "a") as of:
+            print("extern int __VERIFIER_assume(int);", file=of)
+            print("extern int __VERIFIER_inregex(char*, char*);", file=of)
+            print("extern int __VERIFIER_maxstrlen(char*, int);", file=of)
+            print("extern int __VERIFIER_minstrlen(char*, int);", file=of)
+            if isinstance(hypothesis, hypothesis_dfa.HypothesisDFA):
+                print(hypothesis.toC("__hypothesis"), file=of)
+            print("int __cpa_equiv(char* input) {", file=of)
+            if len(self.alphabet) < 256 or self.null_terminated:
+              print("  __VERIFIER_assume(__VERIFIER_inregex(input, \"{0}\"));".format(language_regex), file=of)
+            if max_length >= 0:
+              print("  __VERIFIER_assume(__VERIFIER_maxstrlen(input, {}));".format(max_length), file=of)
+            if min_length >= 0:
+              print("  __VERIFIER_assume(__VERIFIER_minstrlen(input, {}));".format(min_length), file=of)
+            for length in sorted(set(block_lengths)):
+              print("  __VERIFIER_assume(!(__VERIFIER_minstrlen(input, {0}) && __VERIFIER_maxstrlen(input, {0})));".format(length), file=of)
+            for s in block_strings:
+              if s:
+                print("  __VERIFIER_assume(!__VERIFIER_inregex(input, \"{0}\"));".format("".join("\\x{:02x}".format(ord(c)) for c in s)), file=of)
+              else:
+                print("  __VERIFIER_assume(!__VERIFIER_maxstrlen(input, 0));", file=of)
+            print("  int retval = {0}(input);".format(self.kernel_function), file=of)
+            print("  if (retval) {", file=of)
+            write_accepts(of, "    __VERIFIER_assume(!", ");\n")
+            print("    {0};".format("return retval" if True in block_answers else "goto ERROR"), file=of)
+            print("  } else {", file=of)
+            write_accepts(of, "    __VERIFIER_assume(", ");\n")
+            print("    {0};".format("return retval" if False in block_answers else "goto ERROR"), file=of)
+            print("  }", file=of)
+            print("  ERROR: return retval;", file=of)
+            print("}", file=of)
+    
+    def _run_cpachecker(self, cpa_options, running_limit):
+        """Run CPAChecker in the current directory, writing to ./output"""
+        if len(self.portfolio) > 1:
+            self._run_portfolio(cpa_options, running_limit)
+            return
+        
+        cpa_options = CPA_CONFIGURATIONS[self.portfolio[0]] + cpa_options
+        
+        if self.daemon is not None:
+            logger.debug("sending to daemon: {}".format(" ".join(cpa_options)))
+            try:
+                self.daemon.run(cpa_options + ["-outputpath", os.path.abspath("output")],
+                                os.path.abspath("cpachecker.log"),
+                                timeout=running_limit + 60 if self.time_limit != 0 else None)
+                return
+            except cpachecker_daemon.DaemonError as e:
+                logger.error("CPAChecker daemon is unusable (%s); every check from now on runs cpa.sh", e)
+                self.stats["cpachecker_daemon_failures"] += 1
+                self.daemon.close()
+                self.daemon = None
+        
+        cpa_invocation = [self.cpachecker, "-stack", "1000m"] + cpa_options
+        
+        logger.debug("calling: {}".format(" ".join(cpa_invocation)))
+        
+        lsubprocess.call(cpa_invocation, logger)
+    
+    def _run_portfolio(self, cpa_options, running_limit):
+        """Start every configuration of the portfolio, each writing to its own
+        output-NAME directory, and link ./output to the first one that
+        finishes with TRUE or FALSE.  The others are killed."""
+        running = dict()
+        for name in self.portfolio:
+            running[name] = self._start_cpachecker(CPA_CONFIGURATIONS[name] + cpa_options,
+                                                   os.path.abspath("output-" + name),
+                                                   "cpachecker-{}.log".format(name))
+        
+        deadline = time.time() + running_limit + 60 if self.time_limit != 0 else None
+        winner = None
+        while running and winner is None:
+            if deadline is not None and time.time() > deadline:
+                logger.warning("Portfolio ran out of time")
+                break
+            time.sleep(0.1)
+            for name, process in running.items():
+                if process.poll() is None:
+                    continue
+                del running[name]
+                result = self._check_verification_status(os.path.abspath("output-" + name))
+                logger.info("CPAChecker configuration %s finished: %s", name, result)
+                if result in ("TRUE", "FALSE"):
+                    winner = name
+                    break
+        
+        for process in running.itervalues():
+            self._stop_cpachecker(process)
+        
+        if winner is None:
+            logger.warning("No CPAChecker configuration reached a verdict")
+            self._link_output(None)
+            return
+        
+        logger.info("CPAChecker configuration %s won the portfolio", winner)
+        key = "cpachecker_wins_" + winner.replace("-", "_")
+        self.stats[key] = self.stats.get(key, 0) + 1
+        self._link_output("output-" + winner)
+    
+    def _run_bands(self, hypothesis, language_regex, cpa_options, running_limit):
+        """Split the input lengths into bands, check each band in its own
+        band-MIN-MAX directory, at most band_jobs at a time, and link ./output
+        to the band that decides the query: the shortest one with a
+        counterexample, else the first one without a verdict of TRUE.  Bands
+        longer than one that failed are cancelled."""
+        bands = lengthBands(max(self.min_inp_length, 0), self.max_inp_length, self.length_bands)
+        logger.info("Checking %d length bands: %s", len(bands),
+                    ", ".join("{}-{}".format(lo, hi) for lo, hi in bands))
+        
+        directories = list()
+        for lo, hi in bands:
+            band_dir = os.path.abspath("band-{}-{}".format(lo, hi))
+            try:
+                os.makedirs(band_dir)
+            except OSError as exception:
+                if exception.errno != errno.EEXIST:
+                    raise
+            self._write_harness(os.path.join(band_dir, "kernel_equiv.c"), hypothesis, language_regex, lo, hi)
+            directories.append(band_dir)
+        
+        options = CPA_CONFIGURATIONS[self.portfolio[0]] + cpa_options
+        
+        deadline = time.time() + running_limit + 60 if self.time_limit != 0 else None
+        verdicts = [None] * len(bands)
+        pending = collections.deque(range(len(bands)))
+        running = dict()
+        shortest = None
+        while pending or running:
+            while pending and len(running) < self.band_jobs:
+                i = pending.popleft()
+                running[i] = self._start_cpachecker(options + [os.path.join(directories[i], "kernel_equiv.c")],
+                                                    os.path.join(directories[i], "output"),
+                                                    os.path.join(directories[i], "cpachecker.log"))
+            
+            if deadline is not None and time.time() > deadline:
+                logger.warning("Length bands ran out of time")
+                break
+            time.sleep(0.1)
+            
+            for i, process in running.items():
+                if i not in running or process.poll() is None:
+                    # cancelled, or still running
+                    continue
+                del running[i]
+                verdicts[i] = self._check_verification_status(os.path.join(directories[i], "output"))
+                logger.info("Length band %d-%d finished: %s", bands[i][0], bands[i][1], verdicts[i])
+                if verdicts[i] == "FALSE" and (shortest is None or i < shortest):
+                    shortest = i
+                    # longer bands can only find longer counterexamples
+                    pending.clear()
+                    for j in [j for j in running if j > i]:
+                        logger.info("Cancelling length band %d-%d", bands[j][0], bands[j][1])
+                        self._stop_cpachecker(running.pop(j))
+        
+        for process in running.itervalues():
+            self._stop_cpachecker(process)
+        
+        if shortest is not None:
+            deciding = shortest
+        else:
+            undecided = [i for i, verdict in enumerate(verdicts) if verdict != "TRUE"]
+            deciding = undecided[0] if undecided else len(bands) - 1
+        self._link_output(os.path.relpath(os.path.join(directories[deciding], "output")))
+    
+    def _start_cpachecker(self, cpa_options, output_dir, log_file):
+        """Start cpa.sh writing to output_dir without waiting for it"""
+        cpa_invocation = [self.cpachecker, "-stack", "1000m"] + cpa_options + ["-outputpath", output_dir]
+        logger.debug("starting: {}".format(" ".join(cpa_invocation)))
+        with open(log_file, "w") as log:
+            # cpa.sh starts the JVM as a child, so give each run its own
+            # process group to kill
+            return subprocess.Popen(cpa_invocation, stdout=log, stderr=subprocess.STDOUT,
+                                    cwd=os.path.dirname(output_dir), preexec_fn=os.setsid)
+    
+    def _stop_cpachecker(self, process):
+        try:
+            os.killpg(process.pid, signal.SIGKILL)
+        except OSError:
+            pass
+        process.wait()
+    
+    def _link_output(self, target):
+        """Make ./output a link to target, or an empty directory if target is
+        None"""
+        if os.path.islink("output"):
+            os.remove("output")
+        elif os.path.exists("output"):
+            shutil.rmtree("output")
+        if target is None:
+            os.makedirs("output")
+        else:
+            os.symlink(target, "output")
+    
     def _extract_counter_example(self, cpa_dir):
         with chdir.ChDir(cpa_dir):
             try:
@@ -0,0 +1,115 @@
+// Long-lived CPAchecker worker
+//
+// Kevin Angstadt
+// University of Michigan
+//
+// Writes "READY" to stdout once it is running, or "UNSUPPORTED <reason>"
+// if this JVM does not let it trap System.exit.  Then reads one request per
+// line from stdin: the log file followed by the command line arguments of
+// CPAMain, separated by NUL characters.  Each request runs CPAMain in this
+// JVM with its output sent to the log file, and "DONE <status>" is written
+// to stdout when it finishes.  Calls to System.exit made by CPAMain are
+// trapped and become the status.  The trap is a SecurityManager, which
+// JDK 18 and later only allow with -Djava.security.manager=allow.
+
+import java.io.BufferedReader;
+import java.io.FileOutputStream;
+import java.io.InputStreamReader;
+import java.io.PrintStream;
+import java.nio.charset.StandardCharsets;
+import java.security.Permission;
+import java.util.Arrays;
+
+import org.sosy_lab.cpachecker.cmdline.CPAMain;
+
+public class CPAcheckerDaemon {
+
+  private static class ExitTrapped extends SecurityException {
+    private static final long serialVersionUID = 1L;
+    final int status;
+
+    ExitTrapped(int status) {
+      super("System.exit(" + status + ")");
+      this.status = status;
+    }
+  }
+
+  private static class ExitTrap extends SecurityManager {
+    volatile boolean trapping = false;
+
+    @Override
+    public void checkPermission(Permission perm) {}
+
+    @Override
+    public void checkPermission(Permission perm, Object context) {}
+
+    @Override
+    public void checkExit(int status) {
+      if (trapping) {
+        throw new ExitTrapped(status);
+      }
+    }
+  }
+
+  public static void main(String[] args) throws Exception {
+    // the analysis runs in its own thread so that it gets the same large
+    // stack that cpa.sh gives the main thread
+    long stackSize = args.length > 0 ? Long.parseLong(args[0]) : 0;
+
+    PrintStream protocol = System.out;
+
+    ExitTrap trap = new ExitTrap();
+    try {
+      System.setSecurityManager(trap);
+    } catch (UnsupportedOperationException | SecurityException e) {
+      protocol.println("UNSUPPORTED " + e);
+      protocol.flush();
+      return;
+    }
+    protocol.println("READY");
+    protocol.flush();
+
+    PrintStream errors = System.err;
+    BufferedReader in =
+        new BufferedReader(new InputStreamReader(System.in, StandardCharsets.ISO_8859_1));
+
+    String line;
+    while ((line = in.readLine()) != null) {
+      String[] request = line.split("\0");
+      final String[] cpaArgs = Arrays.copyOfRange(request, 1, request.length);
+      final int[] status = {0};
+
+      try (PrintStream log = new PrintStream(new FileOutputStream(request[0]), true)) {
+        System.setOut(log);
+        System.setErr(log);
+
+        Thread worker =
+            new Thread(
+                null,
+                () -> {
+                  try {
+                    CPAMain.main(cpaArgs);
+                  } catch (ExitTrapped e) {
+                    status[0] = e.status;
+                  } catch (Throwable t) {
+                    t.printStackTrace();
+                    status[0] = 1;
+                  }
+                },
+                "cpachecker",
+                stackSize);
+
+        trap.trapping = true;
+        worker.start();
+        worker.join();
+        trap.trapping = false;
+      } finally {
+        System.setOut(protocol);
+        System.setErr(errors);
+      }
+
+      protocol.println("DONE " + status[0]);
+      protocol.flush();
+    }
+  }
+}
@@ -0,0 +1,150 @@
+# Long-lived CPAchecker worker
+#
+# Kevin Angstadt
+# University of Michigan
+
+import errno, logging, os, re, select, signal, subprocess
+
+import logging_subprocess as lsubprocess
+
+logger = logging.getLogger(__name__)
+
+DAEMON_CLASS = "CPAcheckerDaemon"
+DAEMON_SOURCE = os.path.join(os.path.dirname(os.path.realpath(__file__)),
+                             "cpachecker-daemon", DAEMON_CLASS + ".java")
+
+# seconds to wait for the JVM to start
+STARTUP_TIMEOUT = 60
+
+def javaVersion(java):
+    '''Return the major version of the JVM java, or None if unknown'''
+    try:
+        output = subprocess.Popen([java, "-version"], stdout=subprocess.PIPE,
+                                  stderr=subprocess.STDOUT).communicate()[0]
+    except OSError:
+        return None
+    match = re.search(r'version "(\d+)(?:\.(\d+))?', output)
+    if match is None:
+        return None
+    major = int(match.group(1))
+    # 1.8 is Java 8
+    if major == 1 and match.group(2) is not None:
+        major = int(match.group(2))
+    return major
+
+class DaemonError(Exception):
+    def __init__(self, value):
+        self.value = value
+    def __str__(self):
+        return repr(self.value)
+
+class CPAcheckerDaemon(object):
+    '''Runs CPAchecker analyses one after another in a single JVM, so that
+    JVM startup, class loading and JIT warm-up are only paid once.  The
+    daemon is compiled into build_dir and started on the first request.'''
+    def __init__(self, cpachecker_executable, build_dir, stack=1000 << 20):
+        # cpa.sh lives in <cpachecker>/scripts
+        root = os.path.dirname(os.path.dirname(os.path.abspath(cpachecker_executable)))
+        self.build_dir = os.path.abspath(build_dir)
+        self.classpath = ":".join([
+            self.build_dir,
+            os.path.join(root, "bin"),
+            os.path.join(root, "cpachecker.jar"),
+            os.path.join(root, "lib", "*"),
+            os.path.join(root, "lib", "java", "runtime", "*")
+        ])
+        self.stack = stack
+        self.process = None
+
+    def __compile(self):
+        if os.path.exists(os.path.join(self.build_dir, DAEMON_CLASS + ".class")):
+            return
+        try:
+            os.makedirs(self.build_dir)
+        except OSError as exception:
+            if exception.errno != errno.EEXIST:
+                raise
+        logger.info("Compiling the CPAchecker daemon")
+        javac_command = ["javac", "-cp", self.classpath, "-d", self.build_dir, DAEMON_SOURCE]
+        try:
+            status = lsubprocess.call(javac_command, logger)
+        except OSError as e:
+            raise DaemonError("cannot run javac: {}".format(e))
+        if status != 0:
+            raise DaemonError("javac exited with status {}".format(status))
+
+    def __start(self):
+        self.__compile()
+        java = os.environ.get("JAVA", "java")
+        java_command = [java, "-XX:+PerfDisableSharedMem"]
+        # the daemon traps System.exit with a SecurityManager, which JDK 18
+        # and later refuse without this; JDK 11 and earlier would read it
+        # as the name of a SecurityManager class
+        version = javaVersion(java)
+        if version is None or version >= 12:
+            java_command.append("-Djava.security.manager=allow")
+        java_command += ["-cp", self.classpath, DAEMON_CLASS, str(self.stack)]
+        logger.info("Starting the CPAchecker daemon (Java %s)", version)
+        try:
+            self.process = subprocess.Popen(java_command,
+                                            stdin=subprocess.PIPE,
+                                            stdout=subprocess.PIPE)
+        except OSError as e:
+            raise DaemonError("cannot run java: {}".format(e))
+
+        ready, _, _ = select.select([self.process.stdout], [], [], STARTUP_TIMEOUT)
+        line = self.process.stdout.readline() if ready else ""
+        if line.strip() != "READY":
+            self.close()
+            if line.startswith("UNSUPPORTED "):
+                raise DaemonError("the JVM does not allow trapping System.exit: {}".format(line[len("UNSUPPORTED "):].strip()))
+            raise DaemonError("daemon did not start")
+
+    def run(self, args, log_file, timeout=None):
+        '''Run CPAchecker with command line arguments args (as for cpa.sh,
+        without the JVM options) and write its output to log_file.  Returns
+        CPAchecker's exit status, or None if it took longer than timeout
+        seconds, in which case the daemon is restarted on the next request.
+        Raises DaemonError if the daemon cannot be started or dies.'''
+        if self.process is None or self.process.poll() is not None:
+            self.__start()
+
+        try:
+            self.process.stdin.write("\0".join([log_file] + args) + "\n")
+            self.process.stdin.flush()
+        except IOError as e:
+            self.close()
+            raise DaemonError("cannot send request: {}".format(e))
+
+        ready, _, _ = select.select([self.process.stdout], [], [], timeout)
+        if not ready:
+            logger.warning("CPAchecker daemon ran out of time; stopping it")
+            self.close()
+            return None
+
+        line = self.process.stdout.readline()
+        if not line.startswith("DONE "):
+            self.close()
+            raise DaemonError("daemon exited unexpectedly")
+
+        # keep the same log output as running cpa.sh
+        with open(log_file, "r") as f:
+            for log_line in f:
+                if len(log_line.strip()) > 0:
+                    logger.debug(log_line.rstrip("\n"))
+
+        return int(line.split()[1])
+
+    def close(self):
+        if self.process is None:
+            return
+        if self.process.poll() is None:
+            try:
+                self.process.stdin.close()
+            except IOError:
+                pass
+            # an idle daemon exits when stdin is closed, but a running
+            # analysis does not notice
+            self.process.send_signal(signal.SIGKILL)
+        self.process.wait()
+        self.process = None
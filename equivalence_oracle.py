@@ -0,0 +1,147 @@
+# Conformance testing oracles that run before the model checker
+#
+# Kevin Angstadt
+# University of Michigan
+
+import itertools, logging, random
+
+logger = logging.getLogger(__name__)
+
+class OracleStage(object):
+    CACHED_ANSWERS = "cached-answers"
+    RANDOM_WALK = "random-walk"
+    WP_METHOD = "wp-method"
+
+    ALL = [CACHED_ANSWERS, RANDOM_WALK, WP_METHOD]
+
+class TestingOracle(object):
+    '''Looks for a counterexample to a HypothesisDFA by asking the teacher
+    membership queries in batches'''
+    def __init__(self, mat, min_length=0, max_length=-1, batch_size=1000):
+        self.mat = mat
+        self.min_length = min_length
+        self.max_length = max_length
+        self.batch_size = batch_size
+
+    def tests(self, dfa):
+        '''override this to generate the test strings for dfa'''
+        return iter([])
+
+    def inRange(self, s):
+        return len(s) >= self.min_length and (self.max_length < 0 or len(s) <= self.max_length)
+
+    def findCounterexample(self, dfa):
+        '''Return a shortest disagreeing string from the first batch that has
+        one, or None'''
+        tests = (t for t in self.tests(dfa) if self.inRange(t))
+        while True:
+            batch = list(itertools.islice(tests, self.batch_size))
+            if not batch:
+                return None
+            answers = self.mat.isMemberBatch(batch)
+            failed = [t for t, answer in zip(batch, answers) if answer != dfa.accepts(t)]
+            if failed:
+                return min(failed, key=len)
+
+class CachedAnswersOracle(TestingOracle):
+    '''Checks the hypothesis against every answer in the teacher's cache,
+    which costs no kernel runs.  Strings are simulated shortest first, one
+    length at a time, and each string starts from the state its prefix
+    reached in the previous length if that prefix was cached too.'''
+    def findCounterexample(self, dfa):
+        table = dfa.denseTable()
+        accepting = dfa.accepting
+
+        buckets = dict()
+        for s, answer in self.mat.cache.iteritems():
+            if self.inRange(s):
+                buckets.setdefault(len(s), list()).append((s, answer))
+
+        previous = {"": 0}
+        for length in sorted(buckets):
+            current = dict()
+            failed = list()
+            for s, answer in buckets[length]:
+                q = previous.get(s[:-1]) if length > 0 else 0
+                if q is None:
+                    q = 0
+                    for c in s[:-1]:
+                        q = table[256 * q + ord(c)]
+                        if q < 0:
+                            break
+                if q >= 0 and length > 0:
+                    q = table[256 * q + ord(s[-1])]
+                if q < 0:
+                    # a symbol outside of the alphabet, from an older run
+                    continue
+                current[s] = q
+                if accepting[q] != answer:
+                    failed.append(s)
+            if failed:
+                return min(failed)
+            previous = current
+        return None
+
+class RandomWalkOracle(TestingOracle):
+    '''Random walks over the hypothesis: each step picks one of the symbol
+    classes uniformly and then a symbol in it, so that rare transitions are
+    exercised as often as common ones'''
+    def __init__(self, mat, tests=10000, stop_probability=0.1, seed=None, **kwargs):
+        super(RandomWalkOracle, self).__init__(mat, **kwargs)
+        self.num_tests = tests
+        self.stop_probability = stop_probability
+        self.random = random.Random(seed)
+
+    def tests(self, dfa):
+        for _ in range(self.num_tests):
+            s = list()
+            while len(s) < self.min_length or self.random.random() >= self.stop_probability:
+                if self.max_length >= 0 and len(s) >= self.max_length:
+                    break
+                s.append(self.random.choice(self.random.choice(dfa.classes)))
+            yield "".join(s)
+
+class WpMethodOracle(TestingOracle):
+    '''The Wp-method: every state and transition of the hypothesis, followed
+    by every string of up to depth symbols, is checked against the
+    characterizing set (for states) or the state's identifying suffixes (for
+    transitions).  Over the full alphabet, this finds a counterexample for
+    any kernel with at most depth more states than the hypothesis.  Here
+    transitions are taken on every symbol, but the strings in between only
+    use one symbol per class of the hypothesis, which keeps the number of
+    tests linear in the size of the alphabet.'''
+    def __init__(self, mat, depth=1, **kwargs):
+        super(WpMethodOracle, self).__init__(mat, **kwargs)
+        self.depth = depth
+
+    def tests(self, dfa):
+        access = dfa.accessStrings()
+        symbols = dfa.symbols()
+        sep = dfa.separatingSuffixes()
+
+        n = len(dfa)
+        identifying = [set([""]) for _ in range(n)]
+        for (p, q), suffix in sep.iteritems():
+            identifying[p].add(suffix)
+            identifying[q].add(suffix)
+        characterizing = set([""]).union(sep.itervalues())
+
+        middles = [""] + ["".join(m) for k in range(1, self.depth + 1)
+                          for m in itertools.product(symbols, repeat=k)]
+
+        logger.debug("Wp-method: %d states, %d symbol classes, %d suffixes",
+                     n, len(symbols), len(characterizing))
+
+        # first phase: states against the whole characterizing set
+        for s in access:
+            for middle in middles:
+                for suffix in characterizing:
+                    yield s + middle + suffix
+
+        # second phase: transitions against the suffixes of the state reached
+        for s in access:
+            for a in dfa.alphabet:
+                for middle in middles:
+                    state = dfa.state(s + a + middle)
+                    for suffix in identifying[state]:
+                        yield s + a + middle + suffix
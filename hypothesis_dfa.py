@@ -0,0 +1,223 @@
+# Hypothesis DFAs for testing
+#
+# Kevin Angstadt
+# University of Michigan
+
+import collections, inspect, os, re, sys
+
+sys.path.insert(0,os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe()))) + "/MNRL/python")
+
+import anml
+from mnrl import *
+
+def parseCharset(symbols):
+    '''Return the set of bytes matched by a charset such as [\\x61-\\x63\\x7a]'''
+    if symbols.startswith("[") and symbols.endswith("]"):
+        symbols = symbols[1:-1]
+    values = [int(h, 16) if h else ord(c.decode("string_escape"))
+              for h, c in re.findall(r"\\x([0-9a-fA-F]{2})|(\\.|.)", symbols)]
+    tokens = re.findall(r"\\x[0-9a-fA-F]{2}|\\.|.", symbols)
+
+    matched = set()
+    i = 0
+    while i < len(values):
+        if i + 2 < len(values) and tokens[i + 1] == "-":
+            matched.update(range(values[i], values[i + 2] + 1))
+            i += 3
+        else:
+            matched.add(values[i])
+            i += 1
+    return matched
+
+class HypothesisDFA(object):
+    '''The minimal complete DFA of a homogeneous network over alphabet.
+    Symbols that every state treats the same are grouped into classes, and
+    transitions are indexed by class.  If classes (a list of lists of
+    symbols) is given, symbol classes are also kept within those classes.
+    State 0 is the start state, and missing transitions of the network go
+    to a rejecting sink.'''
+    def __init__(self, network, alphabet, classes=None):
+        self.alphabet = list(alphabet)
+        if classes is None:
+            hint = dict()
+        else:
+            hint = dict((a, k) for k, c in enumerate(classes) for a in c)
+
+        # the network as an NFA without epsilons over node ids; None is the
+        # start of data
+        if isinstance(network, anml.AnmlNetwork):
+            nodes = network.elements.values()
+            node_id = lambda n: n.anmlId
+            matches = lambda n: parseCharset(n.symbol)
+            reports = lambda n: n.match
+            starts = lambda n: n.startType == anml.AnmlDefs.START_OF_DATA
+            successors = lambda n: [x.anmlId for x, _ in n.getActivate()]
+        else:
+            nodes = network.nodes.values()
+            node_id = lambda n: n.id
+            matches = lambda n: parseCharset(n.symbols)
+            reports = lambda n: n.report
+            starts = lambda n: n.enable == MNRLDefs.ENABLE_ON_START_AND_ACTIVATE_IN
+            successors = lambda n: [x["id"] for x in n.getOutputConnections()[MNRLDefs.H_STATE_OUTPUT][1]]
+
+        by_id = dict((node_id(n), n) for n in nodes)
+        symbols = dict((i, matches(n)) for i, n in by_id.iteritems())
+        succ = dict((i, [j for j in successors(n) if j in by_id]) for i, n in by_id.iteritems())
+        succ[None] = [node_id(n) for n in nodes if starts(n)]
+        accepting = set(i for i, n in by_id.iteritems() if reports(n))
+
+        # subset construction; the network is deterministic when it comes
+        # from a learner, so this only visits its reachable nodes
+        start = frozenset([None])
+        states = [start]
+        index = {start: 0}
+        delta = list()
+        queue = collections.deque([start])
+        while queue:
+            q = queue.popleft()
+            row = dict()
+            for a in self.alphabet:
+                dest = frozenset(j for i in q for j in succ[i] if ord(a) in symbols[j])
+                if dest not in index:
+                    index[dest] = len(states)
+                    states.append(dest)
+                    queue.append(dest)
+                row[a] = index[dest]
+            delta.append(row)
+        accept = [bool(q & accepting) for q in states]
+
+        self.__minimize(accept, delta, hint)
+
+    def __minimize(self, accept, delta, hint):
+        '''Moore's partition refinement, then group symbols into classes'''
+        n = len(accept)
+        block = [int(a) for a in accept]
+        while True:
+            signatures = dict()
+            new_block = list()
+            for q in range(n):
+                sig = (block[q],) + tuple(block[delta[q][a]] for a in self.alphabet)
+                new_block.append(signatures.setdefault(sig, len(signatures)))
+            if len(signatures) == len(set(block)):
+                break
+            block = new_block
+
+        # renumber so that the start state is 0, in order of discovery
+        order = dict()
+        for q in range(n):
+            order.setdefault(block[q], len(order))
+        block = [order[b] for b in block]
+        m = len(order)
+
+        representative = [None] * m
+        for q in range(n):
+            if representative[block[q]] is None:
+                representative[block[q]] = q
+
+        columns = collections.OrderedDict()
+        for a in self.alphabet:
+            column = tuple(block[delta[q][a]] for q in representative)
+            columns.setdefault((hint.get(a),) + column, list()).append(a)
+
+        # symbol classes, each used through its first member
+        self.classes = columns.values()
+        self.symbol_class = dict((a, k) for k, c in enumerate(self.classes) for a in c)
+        self.accepting = [accept[q] for q in representative]
+        self.delta = [[column[b + 1] for column in columns] for b in range(m)]
+
+    def __len__(self):
+        return len(self.accepting)
+
+    def symbols(self):
+        '''One symbol from each class'''
+        return [c[0] for c in self.classes]
+
+    def state(self, s, state=0):
+        for a in s:
+            state = self.delta[state][self.symbol_class[a]]
+        return state
+
+    def accepts(self, s):
+        return self.accepting[self.state(s)]
+
+    def denseTable(self):
+        '''A flat transition table: the successor of state q on byte c is at
+        q * 256 + c, and is -1 for bytes outside of the alphabet'''
+        table = [-1] * (256 * len(self))
+        for q, row in enumerate(self.delta):
+            base = 256 * q
+            for a, k in self.symbol_class.iteritems():
+                table[base + ord(a)] = row[k]
+        return table
+
+    def toC(self, name):
+        '''C source for a function int name(char *input) that runs the DFA
+        over a NUL-terminated input.  Bytes outside of the alphabet lead to
+        an extra rejecting sink.'''
+        n = len(self)
+        sink_class = len(self.classes)
+        byte_class = [sink_class] * 256
+        for a, k in self.symbol_class.iteritems():
+            byte_class[ord(a)] = k
+
+        rows = [row + [n] for row in self.delta] + [[n] * (sink_class + 1)]
+        accepting = [int(a) for a in self.accepting] + [0]
+
+        lines = list()
+        lines.append("static const int {}_class[256] = {{{}}};".format(name, ", ".join(str(k) for k in byte_class)))
+        lines.append("static const int {}_delta[{}][{}] = {{".format(name, n + 1, sink_class + 1))
+        for row in rows:
+            lines.append("  {{{}}},".format(", ".join(str(q) for q in row)))
+        lines.append("};")
+        lines.append("static const int {}_accepting[{}] = {{{}}};".format(name, n + 1, ", ".join(str(a) for a in accepting)))
+        lines.append("int {}(char* input) {{".format(name))
+        lines.append("  int state = 0;")
+        lines.append("  int i = 0;")
+        lines.append("  while (input[i] != '\\0') {")
+        lines.append("    state = {0}_delta[state][{0}_class[(unsigned char) input[i]]];".format(name))
+        lines.append("    i++;")
+        lines.append("  }")
+        lines.append("  return {}_accepting[state];".format(name))
+        lines.append("}")
+        return "\n".join(lines) + "\n"
+
+    def accessStrings(self):
+        '''Shortest string reaching each state'''
+        access = [None] * len(self)
+        access[0] = ""
+        queue = collections.deque([0])
+        while queue:
+            q = queue.popleft()
+            for k, dest in enumerate(self.delta[q]):
+                if access[dest] is None:
+                    access[dest] = access[q] + self.classes[k][0]
+                    queue.append(dest)
+        return access
+
+    def separatingSuffixes(self):
+        '''Map each pair (p, q), p < q, of states to a shortest suffix on
+        which exactly one of them accepts'''
+        n = len(self)
+        inverse = [[list() for _ in range(n)] for _ in self.classes]
+        for q in range(n):
+            for k, dest in enumerate(self.delta[q]):
+                inverse[k][dest].append(q)
+
+        sep = dict()
+        queue = collections.deque()
+        for p in range(n):
+            for q in range(p + 1, n):
+                if self.accepting[p] != self.accepting[q]:
+                    sep[(p, q)] = ""
+                    queue.append((p, q))
+
+        while queue:
+            p, q = queue.popleft()
+            for k in range(len(self.classes)):
+                for p_1 in inverse[k][p]:
+                    for q_1 in inverse[k][q]:
+                        pair = (p_1, q_1) if p_1 < q_1 else (q_1, p_1)
+                        if p_1 != q_1 and pair not in sep:
+                            sep[pair] = self.classes[k][0] + sep[(p, q)]
+                            queue.append(pair)
+        return sep
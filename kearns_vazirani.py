@@ -0,0 +1,257 @@
+# Kearns-Vazirani Algorithm
+#
+# Kevin Angstadt
+# University of Michigan
+
+import logging
+import random
+
+import checkpoint
+import lstar
+
+logger = logging.getLogger(__name__)
+
+class DiscriminationNode(object):
+    '''A node of the discrimination tree.  Inner nodes hold a discriminator
+    (a suffix) and have a child for each membership outcome; leaves hold the
+    access string of a state of the hypothesis.'''
+    def __init__(self, parent=None, outcome=None, discriminator=None, access=None):
+        self.parent = parent
+        self.outcome = outcome
+        self.discriminator = discriminator
+        self.access = access
+        self.children = dict()
+
+    def isLeaf(self):
+        return self.discriminator is None
+
+class KearnsVazirani(object):
+    __empty = ''
+
+    def __init__(self, alphabet, mat, emit_mnrl=False, verbose=0, seed=None,
+                 checkpoint_file=None, partition=None):
+        '''Create a discrimination tree learner using finite alphabet and mat.
+        If checkpoint_file is given, the learner and mat are saved there after
+        every equivalence round.  If partition (an AlphabetPartition of
+        alphabet) is given, only transitions on the representatives of its
+        classes are sifted, and classes are split as counterexamples
+        demand.'''
+        self.alphabet = alphabet
+        self.partition = partition
+        self.mat = mat
+        self.verbose = verbose
+        self.emit_mnrl = emit_mnrl
+        self.checkpoint_file = checkpoint_file
+
+        self.root = None
+        self.counterexample = None
+        # further counterexamples from the last equivalence query
+        self.counterexamples = list()
+
+        random.seed(seed)
+
+    def getState(self):
+        '''Return the learner's state for a checkpoint'''
+        return dict([
+            ("root", self.root),
+            ("states", self.states),
+            ("delta", self.delta),
+            ("incoming", self.incoming),
+            ("pending", self.pending),
+            ("symbols", self.symbols),
+            ("counterexample", self.counterexample),
+            ("counterexamples", self.counterexamples),
+            ("partition", self.partition)
+        ])
+
+    def setState(self, state):
+        self.root = state["root"]
+        self.states = state["states"]
+        self.delta = state["delta"]
+        self.incoming = state["incoming"]
+        self.pending = state["pending"]
+        self.symbols = state["symbols"]
+        self.counterexample = state["counterexample"]
+        self.counterexamples = state["counterexamples"]
+        self.partition = state["partition"]
+
+    def learn(self):
+        '''Run the Kearns-Vazirani algorithm and learn the state machine.
+        Every state is a leaf of a discrimination tree and every transition
+        is found by sifting its access string down the tree, so a new state
+        costs one query per tree level rather than one per suffix.'''
+
+        if self.root is None:
+            # the root discriminates on acceptance
+            self.root = DiscriminationNode(discriminator=KearnsVazirani.__empty)
+
+            # leaves in the order they were discovered
+            self.states = list()
+            # leaf -> symbol -> leaf
+            self.delta = dict()
+            # leaf -> set of (leaf, symbol) transitions that sifted to it
+            self.incoming = dict()
+            # leaves whose outgoing transitions have not been sifted yet
+            self.pending = list()
+            # symbols with transitions in the hypothesis
+            if self.partition is not None:
+                self.symbols = self.partition.representatives()
+            else:
+                self.symbols = list(self.alphabet)
+
+            self.__sift(KearnsVazirani.__empty, self.root)
+        else:
+            logger.info("Continuing with %d states", len(self.states))
+
+        while True:
+            self.__close()
+
+            logger.info("%d states in the discrimination tree", len(self.states))
+
+            # a single split may not be enough to refute the counterexample,
+            # so reuse it before asking the teacher
+            counterexample = lstar.LStar.pendingCounterexample(self)
+            if counterexample is not None:
+                self.__process_counterexample(counterexample)
+                continue
+
+            machine = self.makeMachine()
+            passed, self.counterexample = self.mat.isEquivalent(machine)
+            self.counterexamples = self.mat.additionalCounterexamples()
+            if passed:
+                break
+            else:
+                self.__process_counterexample(self.counterexample)
+
+            if self.checkpoint_file is not None:
+                checkpoint.save(self.checkpoint_file, self, self.mat)
+
+        logger.info("Found an FSM that passed all queries!")
+        return machine
+
+    def hypothesisState(self, s):
+        '''Return the leaf the hypothesis reaches on s'''
+        if self.partition is not None:
+            s = self.partition.abstract(s)
+        state = self.states[0]
+        for a in s:
+            state = self.delta[state][a]
+        return state
+
+    def hypothesisAccepts(self, s):
+        '''Return whether the hypothesis accepts s'''
+        return self.hypothesisState(s).accepting
+
+    def makeMachine(self):
+        state_ids = dict((leaf, "q{}".format(i)) for i, leaf in enumerate(self.states))
+
+        if self.partition is not None:
+            symbol = self.partition.representative
+        else:
+            symbol = lambda a: a
+
+        report = dict()
+        delta = dict()
+        for leaf in self.states:
+            report[state_ids[leaf]] = leaf.accepting
+            delta[state_ids[leaf]] = dict((a, state_ids[self.delta[leaf][symbol(a)]]) for a in self.alphabet)
+
+        return lstar.LStar.buildMachine(self.alphabet,
+                                        [state_ids[leaf] for leaf in self.states],
+                                        state_ids[self.states[0]],
+                                        report,
+                                        delta,
+                                        emit_mnrl=self.emit_mnrl)
+
+    def __sift(self, s, node):
+        '''Sift s down from node to a leaf.  If s falls off the tree, it is
+        distinguished from every known state and becomes a new leaf.'''
+        while not node.isLeaf():
+            outcome = self.mat.isMember(s + node.discriminator)
+            if outcome not in node.children:
+                return self.__add_leaf(s, node, outcome)
+            node = node.children[outcome]
+        return node
+
+    def __add_leaf(self, s, parent, outcome):
+        leaf = DiscriminationNode(parent=parent, outcome=outcome, access=s)
+        leaf.accepting = self.mat.isMember(s)
+        parent.children[outcome] = leaf
+
+        self.states.append(leaf)
+        self.delta[leaf] = dict()
+        self.incoming[leaf] = set()
+        self.pending.append(leaf)
+
+        if self.verbose >= lstar.LStarUtil.loud:
+            logger.debug("new state '%s'", "".join("{0:02x}".format(ord(c)) for c in s))
+
+        return leaf
+
+    def __set_transition(self, src, a, dest):
+        old = self.delta[src].get(a)
+        if old is not None:
+            self.incoming[old].discard((src, a))
+        self.delta[src][a] = dest
+        self.incoming[dest].add((src, a))
+
+    def __close(self):
+        '''Sift the transitions of every new state'''
+        while self.pending:
+            leaf = self.pending.pop(0)
+            for a in self.symbols:
+                self.__set_transition(leaf, a, self.__sift(leaf.access + a, self.root))
+
+    def __add_symbol(self, a):
+        '''Sift the transitions on a new symbol of every state'''
+        self.symbols.append(a)
+        for leaf in list(self.states):
+            if leaf not in self.pending:
+                self.__set_transition(leaf, a, self.__sift(leaf.access + a, self.root))
+
+    def __process_counterexample(self, counterexample):
+        logger.info("Processing counterexample of length %d", len(counterexample))
+
+        if self.partition is not None:
+            new_symbol, counterexample = lstar.LStar.refinePartition(self.partition, counterexample, self.mat)
+            if new_symbol is not None:
+                # the counterexample is revisited once the new transitions
+                # are sifted
+                self.__add_symbol(new_symbol)
+                return
+
+        # Rivest-Schapire decomposition over the leaves the hypothesis
+        # reaches on each prefix of the counterexample
+        access = [self.states[0]]
+        for a in counterexample:
+            access.append(self.delta[access[-1]][a])
+
+        hi = lstar.LStar.distinguishingPosition(self.mat, [leaf.access for leaf in access], counterexample)
+        lo = hi - 1
+
+        # u_lo + a and u_hi sift to the same leaf but are distinguished by v
+        src = access[lo]
+        a = counterexample[lo]
+        discriminator = counterexample[hi:]
+        self.__split(self.delta[src][a], src.access + a, discriminator)
+
+    def __split(self, leaf, s, discriminator):
+        '''Replace leaf by an inner node on discriminator with leaf and a new
+        state for s as its children'''
+        old_outcome = self.mat.isMember(leaf.access + discriminator)
+        new_outcome = self.mat.isMember(s + discriminator)
+        if old_outcome == new_outcome:
+            raise ValueError("discriminator does not separate '{}' from '{}'".format(leaf.access, s))
+
+        node = DiscriminationNode(parent=leaf.parent, outcome=leaf.outcome, discriminator=discriminator)
+        leaf.parent.children[leaf.outcome] = node
+
+        leaf.parent = node
+        leaf.outcome = old_outcome
+        node.children[old_outcome] = leaf
+        self.__add_leaf(s, node, new_outcome)
+
+        # only transitions that used to reach leaf can change, and they only
+        # need to be sifted from the new node
+        for src, a in list(self.incoming[leaf]):
+            self.__set_transition(src, a, self.__sift(src.access + a, node))
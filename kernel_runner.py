@@ -0,0 +1,267 @@
+# Ways of running a compiled kernel on membership queries
+#
+# Kevin Angstadt
+# University of Michigan
+
+import collections, ctypes, logging, multiprocessing, os, resource, select, signal, time
+
+logger = logging.getLogger(__name__)
+
+def loadKernel(so_path, kernel_function, return_bool=False):
+    '''Load kernel_function from the shared object at so_path'''
+    so = ctypes.cdll.LoadLibrary(so_path)
+    c_kernel = getattr(so, kernel_function)
+    c_kernel.argtypes = [ctypes.c_char_p]
+    c_kernel.restype = ctypes.c_bool if return_bool else ctypes.c_int
+    return c_kernel
+
+class InProcessRunner(object):
+    '''Calls the kernel through ctypes in this process'''
+    def __init__(self, so_path, kernel_function, return_bool=False):
+        self.c_kernel = loadKernel(so_path, kernel_function, return_bool)
+
+    def run(self, inp):
+        return bool(self.c_kernel(inp))
+
+    def runBatch(self, inps):
+        return [bool(self.c_kernel(inp)) for inp in inps]
+
+    def close(self):
+        pass
+
+# name of the entry point in the generated batch harness
+BATCH_FUNCTION = "__batch_kernel"
+
+def writeBatchHarness(filename, kernel_file, kernel_function):
+    '''Write a C file that includes the kernel and adds BATCH_FUNCTION, which
+    runs the kernel on n NUL-terminated inputs packed into buf at offsets and
+    stores each answer in out'''
+    with open(filename, "w") as f:
+        f.write('#include "{}"\n'.format(kernel_file))
+        f.write("void {}(const char *buf, const long *offsets, int n, unsigned char *out) {{\n".format(BATCH_FUNCTION))
+        f.write("  int i;\n")
+        f.write("  for (i = 0; i < n; i++) {\n")
+        f.write("    out[i] = {}((char *) buf + offsets[i]) ? 1 : 0;\n".format(kernel_function))
+        f.write("  }\n")
+        f.write("}\n")
+
+class NativeBatchRunner(object):
+    '''Runs a whole batch with a single foreign call into the generated
+    batch harness'''
+    def __init__(self, so_path):
+        so = ctypes.cdll.LoadLibrary(so_path)
+        self.c_batch = getattr(so, BATCH_FUNCTION)
+        self.c_batch.argtypes = [ctypes.c_char_p,
+                                 ctypes.POINTER(ctypes.c_long),
+                                 ctypes.c_int,
+                                 ctypes.c_char_p]
+        self.c_batch.restype = None
+
+    def run(self, inp):
+        return self.runBatch([inp])[0]
+
+    def runBatch(self, inps):
+        n = len(inps)
+        if n == 0:
+            return []
+
+        # the kernel sees C strings, so an input ends at its first NUL
+        # either way
+        offsets = (ctypes.c_long * n)()
+        offset = 0
+        for i, inp in enumerate(inps):
+            offsets[i] = offset
+            offset += len(inp) + 1
+        buf = "\0".join(inps) + "\0"
+        out = ctypes.create_string_buffer(n)
+
+        self.c_batch(buf, offsets, n, out)
+
+        return [c != "\0" for c in out.raw]
+
+    def close(self):
+        pass
+
+# the runner used by each pool worker
+_worker_runner = None
+
+def _init_worker(so_path, kernel_function, return_bool, batch_so_path):
+    global _worker_runner
+    if batch_so_path is not None:
+        _worker_runner = NativeBatchRunner(batch_so_path)
+    else:
+        _worker_runner = InProcessRunner(so_path, kernel_function, return_bool)
+
+def _run_worker(inps):
+    return _worker_runner.runBatch(inps)
+
+class PoolRunner(object):
+    '''Spreads batches of queries over a pool of worker processes, each of
+    which loads the kernel (or its batch harness) itself'''
+    def __init__(self, so_path, kernel_function, return_bool=False, workers=None,
+                 batch_so_path=None):
+        if workers is None:
+            workers = multiprocessing.cpu_count()
+        self.workers = workers
+        logger.info("Starting %d kernel workers", workers)
+        self.pool = multiprocessing.Pool(workers,
+                                         initializer=_init_worker,
+                                         initargs=(so_path, kernel_function, return_bool, batch_so_path))
+
+    def run(self, inp):
+        return self.pool.apply(_run_worker, ([inp],))[0]
+
+    def runBatch(self, inps):
+        if len(inps) == 0:
+            return []
+        # a few chunks per worker keeps them busy without paying for a
+        # round trip on every query
+        chunksize = len(inps) // (self.workers * 4) + 1
+        chunks = [inps[i:i + chunksize] for i in range(0, len(inps), chunksize)]
+        return [ret for chunk in self.pool.map(_run_worker, chunks) for ret in chunk]
+
+    def close(self):
+        self.pool.terminate()
+        self.pool.join()
+
+class KernelFailure(Exception):
+    def __init__(self, inp, reason):
+        self.inp = inp
+        self.reason = reason
+    def __str__(self):
+        return "kernel {} on input (hex) {}".format(
+            self.reason, "".join("{:02x}".format(ord(c)) for c in self.inp))
+
+class FailureVerdict(object):
+    # answer the query with False and keep learning
+    REJECT = "reject"
+    # stop learning and report the offending input
+    ABORT = "abort"
+
+    ALL = [REJECT, ABORT]
+
+def _sandbox_worker(conn, so_path, kernel_function, return_bool, cpu_time, memory):
+    if memory is not None:
+        resource.setrlimit(resource.RLIMIT_AS, (memory, memory))
+    c_kernel = loadKernel(so_path, kernel_function, return_bool)
+    while True:
+        try:
+            inp = conn.recv()
+        except EOFError:
+            break
+        if inp is None:
+            break
+        # nothing handles SIGVTALRM, so the worker is terminated when the
+        # kernel uses up its CPU time, even in the middle of the C call
+        signal.setitimer(signal.ITIMER_VIRTUAL, cpu_time)
+        ret = bool(c_kernel(inp))
+        signal.setitimer(signal.ITIMER_VIRTUAL, 0)
+        conn.send(ret)
+
+class _SandboxWorker(object):
+    def __init__(self, args):
+        self.conn, child_conn = multiprocessing.Pipe()
+        self.process = multiprocessing.Process(target=_sandbox_worker,
+                                               args=(child_conn,) + args)
+        self.process.daemon = True
+        self.process.start()
+        child_conn.close()
+
+    def kill(self):
+        if self.process.is_alive():
+            os.kill(self.process.pid, signal.SIGKILL)
+        self.process.join()
+        self.conn.close()
+
+    def reason(self):
+        '''Describe why the worker died'''
+        self.process.join()
+        code = self.process.exitcode
+        if code == -signal.SIGVTALRM:
+            return "exceeded its CPU time limit"
+        elif code is not None and code < 0:
+            return "was killed by signal {}".format(-code)
+        return "exited with status {}".format(code)
+
+class SandboxRunner(object):
+    '''Runs the kernel in long-lived forked workers with a CPU time limit
+    per query and an address space limit.  A worker that crashes or hangs is
+    replaced, and the query is answered according to on_failure instead of
+    taking down the learner.'''
+    def __init__(self, so_path, kernel_function, return_bool=False, workers=1,
+                 cpu_time=1.0, memory=None, on_failure=FailureVerdict.REJECT):
+        self.args = (so_path, kernel_function, return_bool, cpu_time, memory)
+        self.on_failure = on_failure
+        # a kernel blocked outside of user code does not use CPU time, so
+        # also give up after a generous amount of wall-clock time
+        self.wall_time = 4 * cpu_time + 1
+
+        # (input, reason) for every query that failed
+        self.failures = list()
+        # indices into the last batch of the queries that failed
+        self.failed = list()
+
+        logger.info("Starting %d sandboxed kernel workers", workers)
+        self.workers = [_SandboxWorker(self.args) for _ in range(workers)]
+
+    def run(self, inp):
+        return self.runBatch([inp])[0]
+
+    def runBatch(self, inps):
+        results = [None] * len(inps)
+        self.failed = list()
+        todo = collections.deque(enumerate(inps))
+        # worker -> (index, input, deadline)
+        busy = dict()
+
+        while todo or busy:
+            for worker in self.workers:
+                if worker not in busy and todo:
+                    i, inp = todo.popleft()
+                    worker.conn.send(inp)
+                    busy[worker] = (i, inp, time.time() + self.wall_time)
+
+            timeout = max(0, min(d for _, _, d in busy.values()) - time.time())
+            ready, _, _ = select.select([w.conn for w in busy], [], [], timeout)
+
+            for worker in list(busy):
+                i, inp, deadline = busy[worker]
+                if worker.conn in ready:
+                    try:
+                        results[i] = worker.conn.recv()
+                        del busy[worker]
+                        continue
+                    except EOFError:
+                        reason = worker.reason()
+                elif time.time() >= deadline:
+                    reason = "exceeded its wall-clock time limit"
+                else:
+                    continue
+
+                del busy[worker]
+                self.__replace(worker)
+                self.failed.append(i)
+                results[i] = self.__fail(inp, reason)
+
+        return results
+
+    def __replace(self, worker):
+        worker.kill()
+        self.workers[self.workers.index(worker)] = _SandboxWorker(self.args)
+
+    def __fail(self, inp, reason):
+        failure = KernelFailure(inp, reason)
+        self.failures.append((inp, reason))
+        if self.on_failure == FailureVerdict.ABORT:
+            logger.error("%s", failure)
+            raise failure
+        logger.warning("%s; rejecting", failure)
+        return False
+
+    def close(self):
+        for worker in self.workers:
+            try:
+                worker.conn.send(None)
+            except IOError:
+                pass
+            worker.kill()
@@ -6,8 +6,10 @@
 import logging, os, sys
 sys.path.append(os.path.dirname(os.path.abspath(__file__)) + '/MNRL/python')
 
-import mnrl, mnrlerror
+import mnrl
 import anml
+import checkpoint
+import observation_table
 import random
 
 logger = logging.getLogger(__name__)
@@ -17,31 +19,75 @@ class LStarUtil(object):
     louder = 2
     loudest = 3
 
+class CounterexampleMode(object):
+    # add the counterexample and all its prefixes to S
+    ANGLUIN = "angluin"
+    # binary search for a single distinguishing suffix and add it to E
+    RIVEST_SCHAPIRE = "rivest-schapire"
+    # add every suffix of the counterexample to E
+    MALER_PNUELI = "maler-pnueli"
+
+    ALL = [ANGLUIN, RIVEST_SCHAPIRE, MALER_PNUELI]
+
 class LStar(object):
     __empty = ''
 
-    def __init__(self, alphabet, mat, emit_mnrl=False, verbose=0, seed=None):
-        '''Create an L* learner using finite alphabet and mat'''
+    def __init__(self, alphabet, mat, emit_mnrl=False, verbose=0, seed=None,
+                 counterexample_mode=CounterexampleMode.ANGLUIN,
+                 checkpoint_file=None, partition=None):
+        '''Create an L* learner using finite alphabet and mat.  If
+        checkpoint_file is given, the learner and mat are saved there after
+        every equivalence round.  If partition (an AlphabetPartition of
+        alphabet) is given, the table only has columns for the
+        representatives of its classes, and classes are split as
+        counterexamples demand.'''
         self.alphabet = alphabet
+        self.partition = partition
         self.mat = mat
         self.verbose = verbose
         self.emit_mnrl = emit_mnrl
+        self.counterexample_mode = counterexample_mode
+        self.checkpoint_file = checkpoint_file
+
+        self.table = None
+        # a counterexample that may still be refuted by the next hypothesis
+        self.counterexample = None
+        # further counterexamples from the last equivalence query
+        self.counterexamples = list()
 
         random.seed(seed)
 
+    def getState(self):
+        '''Return the learner's state for a checkpoint'''
+        return dict([
+            ("table", self.table),
+            ("counterexample", self.counterexample),
+            ("counterexamples", self.counterexamples),
+            ("partition", self.partition)
+        ])
+
+    def setState(self, state):
+        self.table = state["table"]
+        self.table.mat = self.mat
+        self.counterexample = state["counterexample"]
+        self.counterexamples = state["counterexamples"]
+        self.partition = state["partition"]
+
     def learn(self):
         '''Run the L* algorithm and learn the state machine. This is described
         by Angluin, 1987 in figure 1.'''
 
-        # initialize an empty observation table
-        self.observe = dict()
-
-        # Ask membership queries for \lambda and each a \in A
-        self.observe[LStar.__empty] = dict([(LStar.__empty, self.mat.isMember(LStar.__empty))])
-        
-        # Originally, L-star did not as for each a \in A, might be faster
-        # for a in self.alphabet:
-        #     self.observe[a] = dict([(LStar.__empty, self.mat.isMember(a))])
+        if self.table is None:
+            # initialize the observation table with S = E = {\lambda} and ask
+            # membership queries for \lambda and each a \in A
+            if self.partition is not None:
+                symbols = self.partition.representatives()
+            else:
+                symbols = self.alphabet
+            self.table = observation_table.ObservationTable(symbols, self.mat)
+            self.table.initialize()
+        else:
+            logger.info("Continuing with %d rows and %d columns", len(self.table.S), len(self.table.E))
 
         # repeat while (S,E,T) is not closed or not consistent
         while True:
@@ -49,7 +95,7 @@ class LStar(object):
             while True:
                 #print out the observation table if we're not consistent
                 if self.verbose >= LStarUtil.loud:
-                    header = ["".join("{0:02x}".format(ord(c)) for c in a)  if len(a) > 0 else "" for a in self.observe[random.choice(self.observe.keys())].keys()]
+                    header = ["".join("{0:02x}".format(ord(c)) for c in a)  if len(a) > 0 else "" for a in self.table.E]
                     max_len = len(max(header, key=len)) + 2
                     row_format ="{{:>{}}} |".format(max_len) + "{{:>{}}}".format(max(max_len,8)) * (len(header) )
                     
@@ -59,8 +105,8 @@ class LStar(object):
 
                     logger_output += "-" * (max_len+1) + "+" + "-" * (len(header)*max(max_len,8))
 
-                    for s in self.observe:
-                        logger_output += "\n" + row_format.format("".join("{0:02x}".format(ord(c)) for c in s) if len(s) > 0 else "", *[str(self.observe[s][e]) for e in self.observe[s]])
+                    for s in self.table.S:
+                        logger_output += "\n" + row_format.format("".join("{0:02x}".format(ord(c)) for c in s) if len(s) > 0 else "", *[str(t) for t in self.table.cells(s)])
                     
                     logger.debug(logger_output)
 
@@ -81,86 +127,207 @@ class LStar(object):
                     logger.info("Both consistent and closed")
                     break
 
+            # the suffix-based handlers only add a single piece of
+            # information per counterexample, so it may still be a
+            # counterexample for M(S,E,T); reuse it before asking the teacher
+            counterexample = LStar.pendingCounterexample(self)
+            if counterexample is not None:
+                self.__process_counterexample(counterexample)
+                continue
+
             # once (S,E,T) is closed and consistent, let M = M(S,E,T).
             machine = self.makeMachine()
-            passed, counterexample = self.mat.isEquivalent(machine)
+            passed, self.counterexample = self.mat.isEquivalent(machine)
+            self.counterexamples = self.mat.additionalCounterexamples()
             if passed:
                 #we are done
                 break
             else:
-                # If the teacher replies with a conter-example t, then
-                # add t and all its prefixes to S
-                #and extend T to (S \cup S + A) + E using membership queries.
+                self.__process_counterexample(self.counterexample)
 
-                # we need to add each prefix
-                for i in range(len(counterexample)+1):
-                    s = counterexample[0:i]
-                    if s not in self.observe:
-                        self.observe[s] = self.__get_row(s)
+            if self.checkpoint_file is not None:
+                checkpoint.save(self.checkpoint_file, self, self.mat)
 
         logger.info("Found an FSM that passed all queries!")
         return machine
 
     def isConsistent(self):
-        for s_1 in self.observe:
-            for s_2 in self.observe:
-                if self.__get_row(s_1) == self.__get_row(s_2):
-                    for a in self.alphabet:
-                        if self.__get_row(s_1 + a) != self.__get_row(s_2 + a):
-                            return False
-        return True
+        return self.table.findInconsistency() is None
+
+    def hypothesisState(self, s):
+        '''Return the access string of the state M(S,E,T) reaches on s'''
+        if self.partition is not None:
+            s = self.partition.abstract(s)
+        state = LStar.__empty
+        for a in s:
+            state = self.table.representative(state + a)
+        return state
+
+    def hypothesisAccepts(self, s):
+        '''Return whether M(S,E,T) accepts s without building the machine'''
+        return self.table.accepts(self.hypothesisState(s))
+
+    def __process_counterexample(self, counterexample):
+        logger.info("Processing counterexample of length %d (%s)",
+                    len(counterexample), self.counterexample_mode)
+
+        if self.partition is not None:
+            new_symbol, counterexample = LStar.refinePartition(self.partition, counterexample, self.mat)
+            if new_symbol is not None:
+                # the counterexample is revisited once the table is closed
+                self.table.addSymbol(new_symbol)
+                return
+
+        if self.counterexample_mode == CounterexampleMode.RIVEST_SCHAPIRE:
+            suffix = self.__distinguishing_suffix(counterexample)
+            if suffix not in self.table.E:
+                self.table.addSuffix(suffix)
+                return
+            logger.warning("Distinguishing suffix already in E, adding prefixes instead")
+        elif self.counterexample_mode == CounterexampleMode.MALER_PNUELI:
+            for i in range(len(counterexample)):
+                if counterexample[i:] not in self.table.E:
+                    self.table.addSuffix(counterexample[i:])
+            return
+
+        # If the teacher replies with a conter-example t, then
+        # add t and all its prefixes to S
+        #and extend T to (S \cup S + A) + E using membership queries.
+
+        # we need to add each prefix
+        self.table.addPrefixes([counterexample[0:i] for i in range(len(counterexample)+1)])
+
+    def __distinguishing_suffix(self, counterexample):
+        access = [LStar.__empty]
+        for a in counterexample:
+            access.append(self.table.representative(access[-1] + a))
+
+        hi = LStar.distinguishingPosition(self.mat, access, counterexample)
+
+        if self.verbose >= LStarUtil.loud:
+            logger.debug("distinguishing suffix at position %d", hi)
+
+        return counterexample[hi:]
+
+    @staticmethod
+    def pendingCounterexample(learner):
+        '''Return the counterexample learner should process before asking
+        another equivalence query, or None.  This is learner.counterexample
+        while it still refutes the hypothesis, and otherwise the first of
+        the further counterexamples from the last equivalence query that
+        does.  learner needs mat, counterexample, counterexamples and
+        hypothesisAccepts.'''
+        if learner.counterexample is not None and \
+                learner.hypothesisAccepts(learner.counterexample) != learner.mat.isMember(learner.counterexample):
+            logger.info("Counterexample still refutes the hypothesis")
+            return learner.counterexample
+
+        while learner.counterexamples:
+            candidate = learner.counterexamples.pop(0)
+            if learner.hypothesisAccepts(candidate) != learner.mat.isMember(candidate):
+                logger.info("Using another counterexample from the last equivalence query")
+                learner.counterexample = candidate
+                return candidate
+        return None
+
+    @staticmethod
+    def refinePartition(partition, counterexample, mat):
+        '''Split a class of partition if counterexample needs it.  Return
+        the new representative (or None) and the counterexample over the
+        representatives.'''
+        new_symbol = partition.refine(counterexample, mat)
+        if new_symbol is not None:
+            return new_symbol, counterexample
+        return None, partition.abstract(counterexample)
+
+    @staticmethod
+    def distinguishingPosition(mat, access, counterexample):
+        '''Rivest and Schapire, 1993: let alpha(i) = T(u_i + v_i) where u_i
+        = access[i] is the access string of the state the hypothesis reaches
+        on the first i characters of the counterexample and v_i is the rest
+        of it.  alpha(0) is the true answer and alpha(n) is the hypothesis'
+        answer, so they differ.  Binary search for and return an i > 0 with
+        alpha(i-1) != alpha(i); v_i then distinguishes u_i from u_{i-1} + a.'''
+        lo = 0
+        hi = len(counterexample)
+        alpha_lo = mat.isMember(access[lo] + counterexample[lo:])
+        while hi - lo > 1:
+            mid = (lo + hi) // 2
+            if mat.isMember(access[mid] + counterexample[mid:]) == alpha_lo:
+                lo = mid
+            else:
+                hi = mid
+        return hi
 
     def isClosed(self):
-        for a in self.alphabet:
-            for s in self.observe:
-                s_a = self.__get_row(s + a)
-                if not self.__seen_before(s_a):
-                    return False
-        return True
+        return self.table.isClosed()
 
     def makeMachine(self):
+        # see section 2.1 for creating a state machine
+
+        # states map to unique rows in the observation table; the packed row
+        # is formatted once per state to give it an id
+        state_ids = dict()
+        access = list()
+        for row in self.table.S:
+            packed = self.table.row(row)
+            if packed not in state_ids:
+                state_ids[packed] = "{0:x}".format(packed)
+                access.append(row)
+
+        if self.partition is not None:
+            symbol = self.partition.representative
+        else:
+            symbol = lambda a: a
+
+        report = dict()
+        delta = dict()
+        for s_1 in access:
+            state = state_ids[self.table.row(s_1)]
+            report[state] = self.table.accepts(s_1)
+            delta[state] = dict((a, state_ids[self.table.row(s_1+symbol(a))]) for a in self.alphabet)
+
+        return LStar.buildMachine(self.alphabet,
+                                  [state_ids[self.table.row(s_1)] for s_1 in access],
+                                  state_ids[self.table.row(LStar.__empty)],
+                                  report,
+                                  delta,
+                                  emit_mnrl=self.emit_mnrl)
+
+    @staticmethod
+    def buildMachine(alphabet, states, start, report, delta, emit_mnrl=False):
+        '''Build the homogeneous ANML (or MNRL) network of a DFA.  states lists
+        the state ids, start is the initial state, report maps each state to
+        whether it accepts, and delta maps each state to a dict from symbol to
+        destination state.'''
+
         # make this in MNRL first
         mn = mnrl.MNRLNetwork("lstar")
 
-        # see section 2.1 for creating a state machine
-
         # make output port mapping
         output_ports = list()
-        for a in self.alphabet:
+        for a in alphabet:
             output_ports.append(("\\x{0:02x}".format(ord(a)), "\\x{0:02x}".format(ord(a))))
 
-        unique_rows = list()
-
-        # states map to unique rows in the observation table
-        for row in self.observe:
-            try:
-                # this will succeed if we already added the state
-                state = mn.getNodeById(self.__row_to_str(self.observe[row]))
-            except mnrlerror.UnknownNode:
-                # no state was found, so add it
-                state = mn.addState(output_ports,
-                                    id=self.__row_to_str(self.observe[row]),
-                                    attributes={'row': []}
-                                    )
-                unique_rows.append(self.__row_to_str(self.observe[row]))
-
-            if state.enable != mnrl.MNRLDefs.ENABLE_ON_START_AND_ACTIVATE_IN and row == LStar.__empty:
+        unique_rows = list(states)
+
+        for s in unique_rows:
+            state = mn.addState(output_ports, id=s)
+
+            if s == start:
                 state.enable = mnrl.MNRLDefs.ENABLE_ON_START_AND_ACTIVATE_IN
 
-            state.report = state.report or self.observe[row][LStar.__empty]
-            # add this row to the state
-            state.attributes['row'].append(row)
+            state.report = report[s]
         
         # this is an attempt to make character classes
         for s in unique_rows:
           state = mn.getNodeById(s)
           
           dests = dict()
-          for a in self.alphabet:
-            s_1 = state.attributes['row'][0]
-            dest = unique_rows[unique_rows.index(self.__row_to_str(self.__get_row(s_1+a)))]
+          for a in alphabet:
+            dest = delta[s][a]
             
-            if dest not in dests.keys():
+            if dest not in dests:
               dests[dest] = []
             
             dests[dest].append(a)
@@ -168,7 +335,7 @@ class LStar(object):
           # dest now contains the characters for east destination
           charsets = dict()
           for dest, column in dests.iteritems():
-            charsets[self.list_to_charset(column)] = dest
+            charsets[LStar.list_to_charset(column)] = dest
             
           
           state.symbolSet = {k: k for k, _ in charsets.items()}
@@ -200,7 +367,7 @@ class LStar(object):
         # okay, that's a mnrl definition, but we need to convert it to a
         # homogeneous ANML (or MNRL)
 
-        if(self.emit_mnrl):
+        if(emit_mnrl):
             an = mnrl.MNRLNetwork("lstar")
         else:
             an = anml.AnmlNetwork("lstar")
@@ -225,7 +392,7 @@ class LStar(object):
 
                     # only make a new state if we haven't make one for that input symbol yet
                     if src['portId'] not in anml_states[s]:
-                        if(self.emit_mnrl):
+                        if(emit_mnrl):
                             anml_states[s][src['portId']] = an.addHState(
                                 "\\x{0:02x}".format(ord(src['portId'])) if len(src['portId']) == 1 else src['portId'],
                                 enable = mn.getNodeById(src['id']).enable,
@@ -256,90 +423,19 @@ class LStar(object):
                             # now, there may be several states actually representing this mnrl state
                             # so we need to make the connection from each
                             for _,src_ste in anml_states[src['id']].iteritems():
-                                if(self.emit_mnrl):
+                                if(emit_mnrl):
                                     an.addConnection((src_ste.id,mnrl.MNRLDefs.H_STATE_OUTPUT), (an_ste.id,mnrl.MNRLDefs.H_STATE_INPUT))
                                 else:
                                     an.AddAnmlEdge(src_ste, an_ste)
         return an
 
-    def __seen_before(self, row):
-        for s in self.observe:
-            if self.observe[s] == row:
-                return True
-        return False
-
-    def __get_row(self, s):
-        if s in self.observe:
-            return self.observe[s]
-        else:
-            row = dict()
-            for e in self.observe[random.choice(self.observe.keys())]:
-                row[e] = self.mat.isMember(s+e)
-            return row
-    
-    def __row_to_str(self, row):
-        s = ""
-        for k in sorted(row.keys()):
-            if row[k]:
-                s += "1"
-            else:
-                s += "0"
-        return s
-
     def __add_suffix(self):
         # then find s_1 and s_2 \in S, a \in A, and e \in E such that
         # row(s_1) = row(s_2) and T(s_1 + a + e) \neq T(s_2 + a + e),
         # add a + e to E,
         # and extend T to (S \cup S + A) + E using membership queries.
-
-        # keep a chache of seeing this pairing on this round
-        cache = dict()
-
-        # while the property doesn't hold
-        found_new_suffix = False
-        while not found_new_suffix:
-            # find row(s_1) = row(s_2)
-            while True:
-                s_1 = random.choice(self.observe.keys())
-                s_2 = random.choice(self.observe.keys())
-                # s_1 and s_2 should not be the same
-                while s_1 == s_2:
-                    s_2 = random.choice(self.observe.keys())
-
-                if s_1 in cache:
-                    if s_2 in cache[s_1]:
-                        # we've seen this before
-                        continue
-                    else:
-                        cache[s_1].append(s_2)
-                else:
-                    cache[s_1] = [ s_2 ]
-
-                if s_2 in cache:
-                    if s_1 in cache[s_2]:
-                        # we've seen this before
-                        continue
-                    else:
-                        cache[s_2].append(s_1)
-                else:
-                    cache[s_2] = [ s_1 ]
-
-
-                if self.__get_row(s_1) == self.__get_row(s_2):
-                    break
-
-            for a in self.alphabet:
-                if found_new_suffix:
-                    break
-                for e in self.observe[s_1].keys():
-                    if found_new_suffix:
-                        break
-                    if self.mat.isMember(s_1 + a + e) != self.mat.isMember(s_2 + a + e):
-                        # the property holds
-                        new_column = a+e
-                        new_suffix = a
-                        suffix_we_added_to = e
-                        found_new_suffix = True
+        s_1, s_2, new_suffix, suffix_we_added_to = self.table.findInconsistency()
+        new_column = new_suffix + suffix_we_added_to
 
         if self.verbose >= LStarUtil.loud:
             logger.debug("s_1= '" + s_1 + "'")
@@ -347,40 +443,15 @@ class LStar(object):
             logger.debug("e= '" + suffix_we_added_to + "'")
             logger.debug("a= '" +  new_suffix + "'")
 
-        # add new rows (S \cup S + A)
-        # test to see if we can just add the two rows instead of all rows
-        #for s in self.observe.keys():
-        #    if s+new_suffix not in self.observe:
-        #        self.observe[s+new_suffix] = self.__get_row(s+new_suffix)
-        if s_1+new_suffix not in self.observe:
-            self.observe[s_1+new_suffix] = self.__get_row(s_1+new_suffix)
-        if s_2+new_suffix not in self.observe:
-            self.observe[s_2+new_suffix] = self.__get_row(s_2+new_suffix)
-
         # add new column (E \cup {a + e})
-        for s in self.observe:
-            self.observe[s][new_column] = self.mat.isMember(s+new_column)
+        self.table.addSuffix(new_column)
 
     def __add_prefix(self):
         # then find s_1 \in S and a \in A such that
         # row(s_1 + a) is different from row(s) for all s \in S,
         # add s_1 + a to S,
         # and extend T to (S \cup S + A) + E using membership queries
-
-        found_prefix = False
-        while not found_prefix:
-            s_1 = random.choice(self.observe.keys())
-            for a in self.alphabet:
-                if s_1 + a not in self.observe:
-                    new_prefix = self.__get_row(s_1 + a)
-
-                    # verify if this has been seen before
-                    seen_before = self.__seen_before(new_prefix)
-
-                    if not seen_before:
-                        # this is new, add it to the observation table
-                        found_prefix = True
-                        self.observe[s_1 + a] = new_prefix
+        self.table.addPrefix(self.table.findUnclosed())
     
     @staticmethod
     def list_to_charset(column):
@@ -419,10 +490,7 @@ class LStar(object):
               
               # indicate that we're no longer in a range
               crange = False;
-            elif i == max_val:
-              # special case
-              stream = "{0}\\x{1:02x}".format(stream, i)
-          
+
           last_val = i
         
       # if we were in a range when we finished, make sure to emit the last
@@ -0,0 +1,99 @@
+# Persistent membership query cache
+#
+# Kevin Angstadt
+# University of Michigan
+
+import hashlib, logging, sqlite3
+
+logger = logging.getLogger(__name__)
+
+def fingerprint(kernel_source, kernel_function, return_bool, min_inp_length):
+    '''Identify everything that decides the answer to a membership query'''
+    h = hashlib.sha256()
+    h.update(kernel_source)
+    h.update("\0{}\0{}\0{}".format(kernel_function,
+                                   "bool" if return_bool else "int",
+                                   min_inp_length))
+    return h.hexdigest()
+
+class PersistentCache(object):
+    '''A dict-like store of membership answers backed by an SQLite database.
+    Answers for the kernel identified by key are read the first time the
+    cache is used, and new answers are written in batches.'''
+    def __init__(self, path, key, batch_size=10000):
+        self.path = path
+        self.key = key
+        self.batch_size = batch_size
+
+        self.__conn = None
+        self.__data = None
+        self.__unsaved = list()
+        # answers that are only kept for this run
+        self.__volatile = set()
+
+    def __load(self):
+        self.__conn = sqlite3.connect(self.path)
+        self.__conn.execute("CREATE TABLE IF NOT EXISTS answers ("
+                            "  kernel TEXT NOT NULL,"
+                            "  input BLOB NOT NULL,"
+                            "  answer INTEGER NOT NULL,"
+                            "  PRIMARY KEY (kernel, input))")
+        self.__conn.commit()
+
+        self.__data = dict()
+        for inp, answer in self.__conn.execute("SELECT input, answer FROM answers WHERE kernel = ?", (self.key,)):
+            self.__data[str(inp)] = bool(answer)
+        logger.info("Loaded %d cached answers from %s", len(self.__data), self.path)
+
+    @property
+    def data(self):
+        if self.__data is None:
+            self.__load()
+        return self.__data
+
+    def __contains__(self, inp):
+        return inp in self.data
+
+    def __getitem__(self, inp):
+        return self.data[inp]
+
+    def __setitem__(self, inp, value):
+        if self.data.get(inp) is value and inp not in self.__volatile:
+            return
+        self.data[inp] = value
+        self.__volatile.discard(inp)
+        self.__unsaved.append((self.key, sqlite3.Binary(inp), int(value)))
+        if len(self.__unsaved) >= self.batch_size:
+            self.flush()
+
+    def remember(self, inp, value):
+        '''Answer inp with value for the rest of this run without saving
+        it, such as a verdict for a kernel run that failed under limits a
+        later run may raise'''
+        self.data[inp] = value
+        self.__volatile.add(inp)
+
+    def __len__(self):
+        return len(self.data)
+
+    def __iter__(self):
+        return iter(self.data)
+
+    def iteritems(self):
+        return self.data.iteritems()
+
+    def flush(self):
+        '''Write any answers that have not been saved yet'''
+        if not self.__unsaved:
+            return
+        self.__conn.executemany("INSERT OR REPLACE INTO answers (kernel, input, answer) VALUES (?, ?, ?)",
+                                self.__unsaved)
+        self.__conn.commit()
+        logger.debug("Saved %d answers to %s", len(self.__unsaved), self.path)
+        self.__unsaved = list()
+
+    def close(self):
+        if self.__conn is not None:
+            self.flush()
+            self.__conn.close()
+            self.__conn = None
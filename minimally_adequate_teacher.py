@@ -4,6 +4,12 @@
 # Kevin Angstadt
 # University of Michigan
 
+import logging
+
+import membership_cache
+
+logger = logging.getLogger(__name__)
+
 class MinimallyAdequateTeacher(object):
     
     def __init__(self):
@@ -14,6 +20,8 @@ class MinimallyAdequateTeacher(object):
             ("equivalence_queries",0)
         ])
         self.cache = dict()
+        # answers added to an in-memory cache since the last checkpoint
+        self.unsaved = list()
         
         # override this to store any additional information a MAT might need
         pass
@@ -25,6 +33,39 @@ class MinimallyAdequateTeacher(object):
         '''Return stats on the MAT'''
         return self.stats
     
+    def getState(self):
+        '''Return the MAT's state for a checkpoint.  A persistent cache is
+        flushed and only its location is saved; the answers of an in-memory
+        cache are saved separately through newAnswers.'''
+        state = dict([
+            ("stats", dict(self.stats))
+        ])
+        if isinstance(self.cache, membership_cache.PersistentCache):
+            self.cache.flush()
+            state["cache_db"] = (self.cache.path, self.cache.key)
+        return state
+    
+    def newAnswers(self):
+        '''Return the (string, answer) pairs added to an in-memory cache
+        since the last call'''
+        answers = [(string, self.cache[string]) for string in self.unsaved]
+        self.unsaved = list()
+        return answers
+    
+    def setState(self, state):
+        '''Restore a state returned by getState, with the answers saved
+        from newAnswers in state["answers"]'''
+        self.stats.update(state["stats"])
+        if "cache_db" in state:
+            path, key = state["cache_db"]
+            if not isinstance(self.cache, membership_cache.PersistentCache):
+                logger.info("Using the membership cache %s of the checkpoint", path)
+                self.cache = membership_cache.PersistentCache(path, key)
+            elif self.cache.key != key:
+                logger.warning("The checkpoint was made for a different kernel (%s); not using its answers", key)
+        for string, value in state.get("answers", list()):
+            self.cache[string] = value
+    
     def getChache(self, string):
         '''check if string is in the cache.  return None if not in the cache.'''
         if string not in self.cache:
@@ -37,6 +78,8 @@ class MinimallyAdequateTeacher(object):
     def addCache(self, string, value):
         '''update a value in the cache. return value.'''
         self.cache[string] = value
+        if not isinstance(self.cache, membership_cache.PersistentCache):
+            self.unsaved.append(string)
         return value
     
     def isMember(self, comp):
@@ -45,8 +88,25 @@ class MinimallyAdequateTeacher(object):
         self.stats['member_queries'] += 1
         return True
     
+    def isMemberBatch(self, strings):
+        '''override this to answer many membership queries at once. This
+        function should return a list of True or False, one for each string
+        in order.'''
+        return [self.isMember(s) for s in strings]
+    
+    def close(self):
+        '''override this to release any resources held by the MAT'''
+        pass
+    
     def isEquivalent(self, anml_state_machine):
         '''override to implement equivalence queries. This function should
         return (True/False, CounterExample) tuples.'''
         self.stats['equivalence_queries'] += 1
-        return (True, None)
\ No newline at end of file
+        return (True, None)
+
+    def additionalCounterexamples(self):
+        '''override this to return any further counterexamples found by the
+        last equivalence query, besides the one it returned.  Learners
+        process those that still refute their next hypothesis before asking
+        another equivalence query.'''
+        return list()
\ No newline at end of file
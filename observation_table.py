@@ -0,0 +1,195 @@
+# Observation table
+# for Angluin L* Algorithm
+#
+# Kevin Angstadt
+# University of Michigan
+
+class ObservationTable(object):
+    '''The (S, E, T) table of L*.  Rows are kept for every prefix in S and in
+    the boundary S.A, and S is indexed by row signature so that closedness and
+    consistency can be answered incrementally instead of by rescanning the
+    whole table.
+
+    Each row is packed into a single integer whose bit i holds T(s + E[i]),
+    so rows compare and hash as integers rather than as collections of
+    cells.'''
+
+    __empty = ''
+
+    def __init__(self, alphabet, mat):
+        self.alphabet = list(alphabet)
+        self.mat = mat
+
+        # access strings (S) and distinguishing suffixes (E) in the order
+        # they were added
+        self.S = list()
+        self.E = list()
+        self.__in_S = set()
+
+        # the packed row of every prefix in S \cup S.A
+        self.rows = dict()
+
+        # row signature -> prefixes in S with that row.  The first prefix
+        # added for a signature represents its equivalence class.
+        self.classes = dict()
+
+        # row signature -> boundary prefixes with that row for which no
+        # class exists yet (i.e., the witnesses against closedness)
+        self.unclosed = dict()
+
+        # members of S that still have to be compared against the
+        # representative of their class for consistency
+        self.unchecked = list()
+
+    def __getstate__(self):
+        # the teacher is saved separately and reattached by the learner
+        state = dict(self.__dict__)
+        state["mat"] = None
+        return state
+
+    def initialize(self):
+        '''Start with S = E = {lambda}'''
+        self.E.append(ObservationTable.__empty)
+        self.addPrefix(ObservationTable.__empty)
+
+    def __len__(self):
+        return len(self.S)
+
+    def __contains__(self, s):
+        return s in self.__in_S
+
+    def row(self, s):
+        '''Return the row of s, which must be in S \cup S.A'''
+        return self.rows[s]
+
+    def cells(self, s):
+        '''Return the row of s unpacked into a list of T values in the order
+        of E'''
+        row = self.rows[s]
+        return [bool(row >> i & 1) for i in range(len(self.E))]
+
+    def accepts(self, s):
+        '''Return T(s) for s in S \cup S.A'''
+        return bool(self.rows[s] & 1)
+
+    def representative(self, s):
+        '''Return the access string of the class containing row(s)'''
+        return self.classes[self.rows[s]][0]
+
+    def representatives(self):
+        '''Return one access string per distinct row of S'''
+        return [members[0] for members in self.classes.itervalues()]
+
+    def __query_rows(self, prefixes):
+        '''Fill the rows of prefixes with a single batch of membership
+        queries'''
+        answers = iter(self.mat.isMemberBatch([s + e for s in prefixes for e in self.E]))
+        for s in prefixes:
+            row = 0
+            for i in range(len(self.E)):
+                if next(answers):
+                    row |= 1 << i
+            self.rows[s] = row
+
+    def addPrefix(self, s):
+        '''Add s to S and extend T to the new boundary rows s.A'''
+        self.addPrefixes([s])
+
+    def addPrefixes(self, prefixes):
+        '''Add each of prefixes to S, in order, and extend T to the new
+        boundary rows'''
+        prefixes = [s for s in prefixes if s not in self]
+
+        # gather every row that is still missing and ask for all of them at
+        # once
+        missing = list()
+        gathered = set()
+        for s in prefixes:
+            for t in [s] + [s + a for a in self.alphabet]:
+                if t not in self.rows and t not in gathered:
+                    gathered.add(t)
+                    missing.append(t)
+        self.__query_rows(missing)
+
+        for s in prefixes:
+            if s in self:
+                continue
+
+            row = self.rows[s]
+
+            self.S.append(s)
+            self.__in_S.add(s)
+            members = self.classes.setdefault(row, list())
+            members.append(s)
+            if len(members) > 1:
+                self.unchecked.append(s)
+
+            # every boundary row that matched s is now closed
+            self.unclosed.pop(row, None)
+
+            for a in self.alphabet:
+                if s + a not in self and self.rows[s + a] not in self.classes:
+                    self.unclosed.setdefault(self.rows[s + a], set()).add(s + a)
+
+    def addSuffix(self, e):
+        '''Add e to E and extend T to the new column'''
+        bit = 1 << len(self.E)
+        self.E.append(e)
+
+        prefixes = list(self.rows)
+        for s, t in zip(prefixes, self.mat.isMemberBatch([s + e for s in prefixes])):
+            if t:
+                self.rows[s] |= bit
+
+        # a new column can only split classes, so rebuild the index
+        self.classes = dict()
+        self.unchecked = list()
+        for s in self.S:
+            members = self.classes.setdefault(self.rows[s], list())
+            members.append(s)
+            if len(members) > 1:
+                self.unchecked.append(s)
+
+        self.unclosed = dict()
+        for s, row in self.rows.iteritems():
+            if row not in self.classes:
+                self.unclosed.setdefault(row, set()).add(s)
+
+    def addSymbol(self, a):
+        '''Add a to A and extend T to the new boundary rows S.a'''
+        self.alphabet.append(a)
+
+        self.__query_rows([s + a for s in self.S if s + a not in self.rows])
+
+        for s in self.S:
+            if s + a not in self and self.rows[s + a] not in self.classes:
+                self.unclosed.setdefault(self.rows[s + a], set()).add(s + a)
+
+        # every class has to agree on the new symbol as well
+        for members in self.classes.itervalues():
+            self.unchecked.extend(members[1:])
+
+    def isClosed(self):
+        return len(self.unclosed) == 0
+
+    def findUnclosed(self):
+        '''Return a boundary prefix whose row is not in S, or None'''
+        for prefixes in self.unclosed.itervalues():
+            return min(prefixes, key=lambda s: (len(s), s))
+        return None
+
+    def findInconsistency(self):
+        '''Return (s_1, s_2, a, e) with row(s_1) = row(s_2) and
+        T(s_1 + a + e) != T(s_2 + a + e), or None if the table is consistent'''
+        while self.unchecked:
+            s_2 = self.unchecked[-1]
+            s_1 = self.representative(s_2)
+            for a in self.alphabet:
+                diff = self.rows[s_1 + a] ^ self.rows[s_2 + a]
+                if diff:
+                    # the lowest differing column
+                    e = self.E[(diff & -diff).bit_length() - 1]
+                    return (s_1, s_2, a, e)
+            # s_2 agrees with its class on every successor
+            self.unchecked.pop()
+        return None
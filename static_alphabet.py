@@ -0,0 +1,204 @@
+# Static alphabet reduction from kernel source
+#
+# Kevin Angstadt
+# University of Michigan
+
+import logging, re
+
+import alphabet_partition
+
+logger = logging.getLogger(__name__)
+
+# library calls that look at a character in ways the comparisons in the
+# kernel do not show
+OPAQUE_CALLS = set([
+    "isalnum", "isalpha", "isascii", "isblank", "iscntrl", "isdigit",
+    "isgraph", "islower", "isprint", "ispunct", "isspace", "isupper",
+    "isxdigit", "tolower", "toupper",
+    "atoi", "atol", "atoll", "strtol", "strtoul", "strtoll", "strtoull",
+    "strtod", "sscanf", "strspn", "strcspn", "strpbrk", "strcasecmp",
+    "strncasecmp"
+])
+
+EQUALITY = set(["==", "!="])
+RELATIONAL = set(["<", "<=", ">", ">="])
+ARITHMETIC = set(["+", "-", "*", "/", "%", "&", "|", "^", "<<", ">>",
+                  "+=", "-=", "*=", "/=", "%=", "&=", "|=", "^=", "<<=", ">>="])
+BITWISE = set(["|", "^", "~", "<<", ">>", "|=", "^=", "&=", "<<=", ">>="])
+
+_token = re.compile(r'''
+      (?P<char>L?'(?:\\.|[^\\'])+')
+    | (?P<string>L?"(?:\\.|[^\\"])*")
+    | (?P<number>(?:0[xX][0-9a-fA-F]+|\d+)[uUlL]*)
+    | (?P<ident>[A-Za-z_]\w*)
+    | (?P<punct><<=|>>=|<<|>>|<=|>=|==|!=|&&|\|\||\+\+|--|->|[-+*/%&|^~!<>=]=?|[][(){};:,.?])
+    | (?P<space>\s+)
+    | (?P<other>.)
+''', re.VERBOSE | re.DOTALL)
+
+class Inconclusive(Exception):
+    pass
+
+def userLines(preprocessed):
+    '''Keep the lines of gcc -E output that do not come from system headers'''
+    keep = True
+    lines = list()
+    for line in preprocessed.splitlines():
+        m = re.match(r'#\s*\d+\s+"[^"]*"((?:\s+\d+)*)\s*$', line)
+        if m:
+            keep = "3" not in m.group(1).split()
+            continue
+        if line.lstrip().startswith("#"):
+            # #pragma and friends
+            continue
+        if keep:
+            lines.append(line)
+    return "\n".join(lines)
+
+def tokenize(source):
+    tokens = list()
+    for m in _token.finditer(source):
+        kind = m.lastgroup
+        if kind == "space":
+            continue
+        if kind == "other":
+            # a stray backslash or directive we cannot make sense of
+            raise Inconclusive("unexpected character {!r}".format(m.group()))
+        tokens.append((kind, m.group()))
+    return tokens
+
+def _unescape(literal):
+    body = literal.lstrip("L")[1:-1]
+    try:
+        return body.decode("string_escape")
+    except ValueError:
+        raise Inconclusive("cannot decode literal {}".format(literal))
+
+def _byte(value):
+    '''The byte a comparison against value can match, if any'''
+    if -128 <= value <= 255:
+        return value & 0xff
+    return None
+
+def _is_operand_end(kind, text):
+    if kind == "ident":
+        return text not in ("case", "return", "sizeof")
+    return kind in ("number", "char", "string") or text in (")", "]")
+
+def analyze(source):
+    '''Find the bytes the kernel in source compares against.  Returns a pair
+    (singletons, cuts): every byte in singletons behaves differently from all
+    others, and the remaining bytes are told apart only by which side of each
+    cut (a relational comparison against that value) they fall on.  Raises
+    Inconclusive if the kernel looks at characters in other ways.'''
+    tokens = tokenize(source)
+
+    singletons = set([0])
+    cuts = set()
+    found = False
+
+    def number(i):
+        '''The value of the (possibly negated) integer or character
+        constant at tokens[i], and the index of the token before it'''
+        kind, text = tokens[i]
+        if kind == "number":
+            value = int(text.rstrip("uUlL"), 0)
+        else:
+            chars = _unescape(text)
+            if len(chars) != 1:
+                raise Inconclusive("multi-character constant {}".format(text))
+            value = ord(chars)
+        if i > 0 and tokens[i - 1][1] == "-" and \
+                (i < 2 or not _is_operand_end(*tokens[i - 2])):
+            return -value, i - 2
+        return value, i - 1
+
+    for i, (kind, text) in enumerate(tokens):
+        if kind == "ident" and text in OPAQUE_CALLS:
+            raise Inconclusive("call to {}".format(text))
+
+        if kind == "punct" and text in BITWISE:
+            raise Inconclusive("bitwise operator {}".format(text))
+
+        if text == "[":
+            # a subscript indexed by another subscript is a table lookup
+            depth = 0
+            for j in range(i + 1, len(tokens)):
+                if tokens[j][1] == "[" and depth == 0:
+                    raise Inconclusive("table lookup")
+                if tokens[j][1] in ("(", "["):
+                    depth += 1
+                elif tokens[j][1] in (")", "]"):
+                    if depth == 0:
+                        break
+                    depth -= 1
+
+        if kind == "string":
+            # every character of a string may be compared to the input
+            singletons.update(ord(c) for c in _unescape(text))
+            found = True
+            continue
+
+        if kind == "char":
+            prev = tokens[i - 1][1] if i > 0 else None
+            nxt = tokens[i + 1][1] if i + 1 < len(tokens) else None
+            binary_minus = prev == "-" and i > 1 and _is_operand_end(*tokens[i - 2])
+            if (prev in ARITHMETIC and prev != "-") or binary_minus or nxt in ARITHMETIC:
+                # for example c - '0'
+                raise Inconclusive("arithmetic on {}".format(text))
+
+        if kind not in ("number", "char"):
+            continue
+
+        value, before = number(i)
+        prev = tokens[before][1] if before >= 0 else None
+        nxt = tokens[i + 1][1] if i + 1 < len(tokens) else None
+
+        if prev in RELATIONAL or nxt in RELATIONAL:
+            # > v and <= v split at v + 1, < v and >= v at v; keep both
+            # and the sign boundary so either signedness of char is covered
+            for v in (value, value + 1):
+                if 0 <= v <= 255:
+                    cuts.add(v)
+                elif -128 <= v < 0:
+                    cuts.add(v & 0xff)
+            cuts.add(0x80)
+            found = True
+        elif prev == "case" or prev in EQUALITY or nxt in EQUALITY or kind == "char":
+            # a character constant is compared sooner or later, even if it
+            # is first stored in a variable
+            b = _byte(value)
+            if b is not None:
+                singletons.add(b)
+            found = True
+
+    if not found:
+        raise Inconclusive("no character comparisons found")
+
+    return singletons, cuts
+
+def partition(source, alphabet):
+    '''Derive an AlphabetPartition of alphabet for the kernel in source.
+    Falls back to one class per symbol if the analysis is inconclusive.  The
+    partition is only a starting point; a learner still splits classes that
+    counterexamples show to be wrong.'''
+    alphabet = list(alphabet)
+    try:
+        singletons, cuts = analyze(userLines(source))
+    except Inconclusive as e:
+        logger.warning("Static alphabet reduction is inconclusive (%s); using the full alphabet", e)
+        return alphabet_partition.AlphabetPartition(alphabet, [[a] for a in alphabet])
+
+    classes = dict()
+    bounds = sorted(cuts)
+    for a in alphabet:
+        if ord(a) in singletons:
+            key = ("singleton", ord(a))
+        else:
+            key = ("interval", len([c for c in bounds if c <= ord(a)]))
+        classes.setdefault(key, list()).append(a)
+
+    result = alphabet_partition.AlphabetPartition(alphabet, sorted(classes.values()))
+    logger.info("Static alphabet reduction: %d symbols in %d classes: %s",
+                len(alphabet), len(result.classes), result)
+    return result